@@ -5,19 +5,37 @@ Versión 2.0 - Con clasificación automática desde librería y corrección de p
 """
 
 import os
+import io
+import sys
 import base64
 import re
 import json
+import time
+import hashlib
 import pdfplumber
-import pandas as pd
+import pypdfium2 as pdfium
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from email.utils import parsedate_to_datetime
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 from dotenv import load_dotenv
 
+# Módulos hermanos de scripts/ (funciona tanto como `Procesar` como `scripts.Procesar`)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from cache_gmail import CACHE
+from cache_libreria import reglas_compiladas
+from cache_parseo import CACHE_PARSEO, sha256_pdf
+from cliente_gmail import crear_servicio_gmail, http_hilo, token_por_vencer
+from control_cuota import CONTROLADOR, UNIDADES_POR_TIPO, es_error_limite, http_status
+from lineas_pdf import parse_lineas, parse_number
+from motor_reglas import MEMO_CLASIFICACION, MotorReglas
+from plantillas_pdf import paginas_recortadas, plantilla_coincide, plantilla_documento
+from pool_aislado import PoolAislado, TareaAbandonada
+from sincronizacion import read_history_id, save_history_id, sync_messages
+
 # Cargar .env UNA SOLA VEZ
 load_dotenv()
 
@@ -27,12 +45,44 @@ load_dotenv()
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 PROJECT_ID = 'rodenstock-471300'
 DATASET = "facturacion"
-OUTPUT_DIR = "outputs"
+# Gmail simulado sin red (ver gmail_simulado.py): salidas y estado van a un directorio aparte
+GMAIL_FAKE = os.getenv('GMAIL_FAKE')
+OUTPUT_DIR = "outputs_simulado" if GMAIL_FAKE else "outputs"
 PDF_SAVE_DIR = "pdf_attachments"
-LAST_PROCESSED_DATE_FILE = 'last_processed.txt'
-PROCESSED_MSGS_FILE = 'processed_messages.json'
+# Pasar los PDF al parser como bytes en memoria en vez de escribirlos en PDF_SAVE_DIR
+PDF_EN_MEMORIA = os.getenv('PDF_EN_MEMORIA', '1') == '1'
+STATE_DIR = OUTPUT_DIR if GMAIL_FAKE else "."
+LAST_PROCESSED_DATE_FILE = os.path.join(STATE_DIR, 'last_processed.txt')
+PROCESSED_MSGS_FILE = os.path.join(STATE_DIR, 'processed_messages.json')
+HISTORY_ID_FILE = os.path.join(STATE_DIR, 'last_history_id.txt')
 LIBRERIA_PATH = 'scripts/libreria.xlsx'
-BASE_QUERY = 'from:facturacion@rodenstock.cl in:inbox'
+REMITENTE = 'facturacion@rodenstock.cl'
+BASE_QUERY = f'from:{REMITENTE} in:inbox'
+# 'history' = incremental con la History API (cae a 'query' si no hay historyId o expiró)
+GMAIL_SYNC_MODE = os.getenv('GMAIL_SYNC_MODE', 'history')
+# Mensajes por request batch de Gmail (máx. recomendado 50). 0 o 1 = GETs seriales
+GMAIL_BATCH_SIZE = int(os.getenv('GMAIL_BATCH_SIZE', '50'))
+# Máscara `fields=` para messages().get: solo encabezados y descriptores de adjuntos
+ENVELOPE_FIELDS = ('id,internalDate,payload(partId,headers(name,value),filename,body(attachmentId,size),'
+                   'parts(partId,filename,body(attachmentId,size)))')
+# Hilos para descargar adjuntos en paralelo entre mensajes. 0 o 1 = descarga serial
+GMAIL_DOWNLOAD_WORKERS = int(os.getenv('GMAIL_DOWNLOAD_WORKERS', '4'))
+# Procesos para parsear PDFs en paralelo (CPU). 0 o 1 = un solo proceso (el principal si PDF_TIMEOUT_S=0)
+PDF_PARSE_WORKERS = int(os.getenv('PDF_PARSE_WORKERS', str(os.cpu_count() or 1)))
+# Motor de extracción de texto: 'pdfplumber' (por defecto) o 'pypdfium2' (más rápido)
+PDF_BACKEND = os.getenv('PDF_BACKEND', 'pdfplumber')
+# Extraer solo las regiones de la plantilla del tipo de documento (scripts/plantillas_pdf.json)
+PDF_RECORTE = os.getenv('PDF_RECORTE', '0') == '1'
+# Versión del parser para el cache de parseos: subirla al cambiar la extracción,
+# los patrones de encabezado o de líneas, y los resultados guardados dejan de usarse
+PARSER_VERSION = '2026.10-1'
+# Tope de crecimiento del RSS por documento: al superarlo se re-extrae con el motor liviano. 0 = sin tope
+PDF_MAX_RSS_MB = int(os.getenv('PDF_MAX_RSS_MB', '512'))
+PDF_BACKEND_LIVIANO = 'pypdfium2'
+# Tiempo máximo por PDF (s): se parsea en un proceso aislado que se mata al superarlo, y el PDF
+# queda en PDFS_FALLIDOS_FILE. 0 = sin tope (con 0 o 1 workers se parsea en el proceso principal)
+PDF_TIMEOUT_S = float(os.getenv('PDF_TIMEOUT_S', '120'))
+PDFS_FALLIDOS_FILE = os.path.join(STATE_DIR, 'pdfs_fallidos.jsonl')
 
 
 # ============ FUNCIONES DE UTILIDAD ============
@@ -40,101 +90,30 @@ BASE_QUERY = 'from:facturacion@rodenstock.cl in:inbox'
 def ensure_dirs():
     """Crea directorios necesarios si no existen"""
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    os.makedirs(PDF_SAVE_DIR, exist_ok=True)
+    if not PDF_EN_MEMORIA:
+        os.makedirs(PDF_SAVE_DIR, exist_ok=True)
+
+
+_ESPACIOS_RE = re.compile(r'\s+')
 
 
 def normalize_text(s):
     """Normaliza texto: elimina espacios extra y convierte a string"""
     if s is None:
         return ''
-    return re.sub(r'\s+', ' ', str(s)).strip()
-
-
-def limpiar_prefijo_numerico(texto):
-    """
-    Elimina prefijos numéricos al inicio del texto.
-    Ejemplos: "65 Progressiv Pro L" -> "Progressiv Pro L"
-    """
-    if not texto:
-        return texto
-    texto = str(texto).strip()
-    texto_limpio = re.sub(r'^\d+\s+', '', texto)
-    return texto_limpio.strip()
-
-
-def parse_number(s):
-    """
-    Convierte string a número manejando formatos chilenos y decimales.
-    
-    Casos:
-    - "8.306" con punto → Si tiene 3 dígitos después del punto = miles → 8306
-    - "6.98" con punto → Si tiene 1-2 dígitos después del punto = decimal → 6.98
-    - "6,98" → coma es decimal → 6.98
-    - "1.234,56" → punto miles, coma decimal → 1234.56
-    """
-    if s is None:
-        return None
-    if isinstance(s, (int, float)):
-        return s
-    
-    s = str(s).strip()
-    if s == '' or s == '-':
-        return None
-    
-    # Eliminar espacios
-    s = s.replace(' ', '')
-    
-    # Detectar si tiene tanto punto como coma
-    tiene_punto = '.' in s
-    tiene_coma = ',' in s
-    
-    if tiene_punto and tiene_coma:
-        # Formato: 1.234,56 → punto es miles, coma es decimal
-        s = s.replace('.', '').replace(',', '.')
-    elif tiene_coma and not tiene_punto:
-        # Formato: 1234,56 → coma es decimal
-        s = s.replace(',', '.')
-    elif tiene_punto and not tiene_coma:
-        # Ambiguo: puede ser miles o decimal
-        # Detectar basándose en la posición del punto
-        partes = s.split('.')
-        if len(partes) == 2:
-            parte_entera = partes[0]
-            parte_decimal = partes[1]
-            
-            # Si la parte decimal tiene exactamente 3 dígitos, probablemente es separador de miles
-            # Ejemplo: "8.306" → 8306
-            if len(parte_decimal) == 3 and parte_entera.isdigit() and parte_decimal.isdigit():
-                s = parte_entera + parte_decimal
-            # Si la parte decimal tiene 1 o 2 dígitos, es decimal
-            # Ejemplo: "6.98" → 6.98
-            elif len(parte_decimal) <= 2:
-                # Dejar el punto como está (ya es formato decimal correcto)
-                pass
-            else:
-                # Caso extraño, eliminar puntos
-                s = s.replace('.', '')
-    
-    # Limpiar caracteres no numéricos excepto punto y signo negativo
-    s = re.sub(r'[^\d\.\-]', '', s)
-    
-    try:
-        if s == '' or s == '-':
-            return None
-        val = float(s) if '.' in s else int(s)
-        return val
-    except:
-        return None
+    return _ESPACIOS_RE.sub(' ', str(s)).strip()
 
 
 # ============ LIBRERÍA DE PRODUCTOS ============
 
-def cargar_libreria():
+def compilar_libreria(ruta=LIBRERIA_PATH):
     """
-    Carga la librería de productos y la estructura en 3 tipos de reglas.
+    Lee la librería de productos del xlsx y la estructura en 3 tipos de reglas.
     Normaliza todo a minúsculas para comparación.
     """
-    df = pd.read_excel(LIBRERIA_PATH)
+    import pandas as pd  # solo al recompilar: el artefacto evita pandas y openpyxl
+
+    df = pd.read_excel(ruta)
     
     reglas = {
         'producto_y_tratamiento': [],
@@ -179,63 +158,49 @@ def cargar_libreria():
     reglas['producto_y_tratamiento'].sort(key=lambda x: x['especificidad'], reverse=True)
     reglas['solo_producto'].sort(key=lambda x: x['especificidad'], reverse=True)
     reglas['solo_tratamiento'].sort(key=lambda x: x['especificidad'], reverse=True)
-    
-    print(f"✅ Librería cargada: {len(reglas['producto_y_tratamiento'])} producto+tratamiento, "
+
+    # Autómata con los textos de todas las reglas (ver motor_reglas.py)
+    reglas['motor'] = MotorReglas(reglas)
+    return reglas
+
+
+def cargar_libreria():
+    """
+    Reglas de la librería desde el artefacto compilado (cache_libreria.py);
+    solo se relee el xlsx si cambió su contenido.
+    """
+    reglas, origen = reglas_compiladas(LIBRERIA_PATH, compilar_libreria)
+    print(f"✅ Librería cargada ({origen}): {len(reglas['producto_y_tratamiento'])} producto+tratamiento, "
           f"{len(reglas['solo_producto'])} solo producto, {len(reglas['solo_tratamiento'])} solo tratamiento")
-    
     return reglas
 
 
-def clasificar_lineas_factura(lineas, reglas):
+def texto_factura(lineas):
+    """TODAS las descripciones de la factura en un solo texto normalizado (minúsculas)"""
+    return ' '.join([
+        normalize_text(linea.get('descripcion', '')).lower() 
+        for linea in lineas
+    ])
+
+
+def clasificar_lineas_factura(lineas, reglas, texto_completo=None):
     """
     Clasifica todas las líneas de una factura buscando coincidencias con la librería.
     Retorna la categoría más específica encontrada.
-    Búsqueda en texto completo de la factura y prioridad por especificidad.
+    Búsqueda en texto completo de la factura y prioridad por especificidad
+    (producto+tratamiento, luego solo tratamiento, luego solo producto).
+    `texto_completo` evita recalcular texto_factura(lineas) si ya se tiene.
     """
     if not lineas:
         return 'Sin clasificacion', 'Sin clasificacion'
     
-    # Extraer TODAS las descripciones de la factura en un solo texto normalizado
-    texto_completo = ' '.join([
-        normalize_text(linea.get('descripcion', '')).lower() 
-        for linea in lineas
-    ])
-    
-    mejor_match = None
-    mayor_especificidad = 0
-    
-    # PRIORIDAD 1: Buscar coincidencia de producto Y tratamiento
-    for regla in reglas['producto_y_tratamiento']:
-        if regla['producto'] in texto_completo and regla['tratamiento'] in texto_completo:
-            if regla['especificidad'] > mayor_especificidad:
-                mejor_match = regla
-                mayor_especificidad = regla['especificidad']
-    
-    if mejor_match:
-        return mejor_match['categoria'], mejor_match['subcategoria']
-    
-    # PRIORIDAD 2: Buscar coincidencia solo por tratamiento
-    for regla in reglas['solo_tratamiento']:
-        if regla['tratamiento'] in texto_completo:
-            if regla['especificidad'] > mayor_especificidad:
-                mejor_match = regla
-                mayor_especificidad = regla['especificidad']
-    
-    if mejor_match:
-        return mejor_match['categoria'], mejor_match['subcategoria']
-    
-    # PRIORIDAD 3: Buscar coincidencia solo por producto
-    for regla in reglas['solo_producto']:
-        if regla['producto'] in texto_completo:
-            if regla['especificidad'] > mayor_especificidad:
-                mejor_match = regla
-                mayor_especificidad = regla['especificidad']
+    if texto_completo is None:
+        texto_completo = texto_factura(lineas)
     
-    if mejor_match:
-        return mejor_match['categoria'], mejor_match['subcategoria']
-    
-    # No se encontró clasificación
-    return 'Sin clasificacion', 'Sin clasificacion'
+    # Todas las reglas se buscan en una pasada con el autómata de la librería;
+    # las facturas repetidas salen del memo
+    motor = reglas.get('motor') or reglas.setdefault('motor', MotorReglas(reglas))
+    return MEMO_CLASIFICACION.clasificar(motor, texto_completo)
 
 
 # ============ GMAIL ============
@@ -245,8 +210,9 @@ def authenticate_gmail():
     creds = None
     if os.path.exists('token.json'):
         creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
+    # Renovar también si está por vencer: una corrida larga no debe cruzar el vencimiento
+    if not creds or token_por_vencer(creds):
+        if creds and creds.refresh_token:
             creds.refresh(Request())
         else:
             credentials_path = os.getenv('GOOGLE_CREDENTIALS_PATH', 'config/credentials.json')
@@ -254,51 +220,240 @@ def authenticate_gmail():
             creds = flow.run_local_server(port=0)
         with open('token.json', 'w') as f:
             f.write(creds.to_json())
-    return build('gmail', 'v1', credentials=creds)
-
-
-def get_all_messages(service, query):
-    """Obtiene todos los mensajes que coinciden con el query"""
-    messages = []
-    page_token = None
-    while True:
-        resp = service.users().messages().list(userId='me', q=query, pageToken=page_token).execute()
-        msgs = resp.get('messages', [])
-        if not msgs:
-            break
-        messages.extend(msgs)
-        page_token = resp.get('nextPageToken')
-        if not page_token:
-            break
-    return messages
-
-
-def save_pdf_attachments(service, msg_id):
-    """Guarda adjuntos PDF de un mensaje"""
-    saved_files = []
+    return crear_servicio_gmail(creds, token_file='token.json')
+
+
+def message_request(service, msg_id):
+    """Request GET de un mensaje recortado con ENVELOPE_FIELDS"""
+    return service.users().messages().get(userId='me', id=msg_id, format='full', fields=ENVELOPE_FIELDS)
+
+
+def build_envelope(message):
+    """
+    Reduce un mensaje de Gmail a su sobre:
+    {'id', 'internal_date', 'headers': {nombre: valor}, 'attachments': [{'filename', 'attachment_id', 'size'}]}
+    """
+    payload = message.get('payload', {}) or {}
+    headers = {}
+    for h in payload.get('headers', []) or []:
+        headers.setdefault(h.get('name'), h.get('value'))
+
+    attachments = []
+    for part in payload.get('parts', []) or [payload]:
+        body = part.get('body', {}) or {}
+        if part.get('filename') and body.get('attachmentId'):
+            attachments.append({
+                'part_id': part.get('partId'),
+                'filename': part['filename'],
+                'attachment_id': body['attachmentId'],
+                'size': body.get('size'),
+            })
+
+    return {
+        'id': message.get('id'),
+        'internal_date': message.get('internalDate'),
+        'headers': headers,
+        'attachments': attachments,
+    }
+
+
+def _download_envelope(service, msg_id):
+    """GET del sobre a Gmail, guardándolo en el cache local"""
+    envelope = build_envelope(CONTROLADOR.ejecutar('messages.get', message_request(service, msg_id).execute))
+    CACHE.put_envelope(msg_id, envelope)
+    return envelope
+
+
+def fetch_envelope(service, msg_id):
+    """Obtiene el sobre de un mensaje: del cache local o con un único GET"""
+    envelope = CACHE.get_envelope(msg_id)
+    if envelope is None:
+        envelope = _download_envelope(service, msg_id)
+    return envelope
+
+
+def get_envelopes_batch(service, msg_ids, batch_size=GMAIL_BATCH_SIZE):
+    """
+    Obtiene los sobres de varios mensajes: primero del cache local y el resto
+    agrupando los GET en requests batch de Gmail.
+    Retorna (sobres, errores): dicts msg_id -> sobre / msg_id -> excepción.
+    Con batch_size <= 1 hace un GET serial por mensaje.
+    """
+    sobres, errores = {}, {}
+    faltantes = []
+    for msg_id in msg_ids:
+        envelope = CACHE.get_envelope(msg_id)
+        if envelope is not None:
+            sobres[msg_id] = envelope
+        else:
+            faltantes.append(msg_id)
+    msg_ids = faltantes
+
+    if batch_size <= 1:
+        for msg_id in msg_ids:
+            try:
+                sobres[msg_id] = _download_envelope(service, msg_id)
+            except Exception as e:
+                errores[msg_id] = e
+        return sobres, errores
+
+    limitados = []
+
+    def _callback(request_id, response, exception):
+        if exception is None:
+            sobres[request_id] = build_envelope(response)
+            CACHE.put_envelope(request_id, sobres[request_id])
+        elif es_error_limite(exception):
+            limitados.append(request_id)
+        else:
+            errores[request_id] = exception
+
+    def _enviar(ids):
+        # Si el controlador reintenta el batch completo, no repetir ítems ya resueltos
+        batch = service.new_batch_http_request(callback=_callback)
+        for msg_id in ids:
+            if msg_id not in sobres and msg_id not in errores and msg_id not in limitados:
+                batch.add(message_request(service, msg_id), request_id=msg_id)
+        batch.execute()
+
+    for inicio in range(0, len(msg_ids), batch_size):
+        lote = msg_ids[inicio:inicio + batch_size]
+        intento = 0
+        while lote:
+            try:
+                CONTROLADOR.ejecutar('messages.get', lambda: _enviar(lote),
+                                     unidades=UNIDADES_POR_TIPO['messages.get'] * len(lote))
+            except Exception as e:
+                # Falló el batch completo (red, auth): los pendientes del lote quedan con error
+                for msg_id in lote:
+                    if msg_id not in sobres and msg_id not in errores and msg_id not in limitados:
+                        errores[msg_id] = e
+            # Ítems rechazados por cuota dentro del batch: reintentar solo esos tras el backoff
+            lote = list(limitados)
+            limitados.clear()
+            if lote:
+                if intento >= CONTROLADOR.max_reintentos:
+                    for msg_id in lote:
+                        errores[msg_id] = RuntimeError("límite de cuota de Gmail tras reintentos")
+                    break
+                CONTROLADOR.registrar_limite()
+                time.sleep(CONTROLADOR.backoff(intento))
+                intento += 1
+    return sobres, errores
+
+
+def iter_envelopes(service, pendientes, batch_size=GMAIL_BATCH_SIZE):
+    """
+    Recorre [(posicion, msg_id), ...] trayendo los sobres por lotes.
+    Genera (posicion, msg_id, sobre, error) en el mismo orden de entrada.
+    Los mensajes que ya no existen (404: borrados después de listarlos) se
+    omiten sin contarlos como error.
+    """
+    paso = max(batch_size, 1)
+    for inicio in range(0, len(pendientes), paso):
+        lote = pendientes[inicio:inicio + paso]
+        sobres, errores = get_envelopes_batch(service, [msg_id for _, msg_id in lote], batch_size)
+        for posicion, msg_id in lote:
+            if http_status(errores.get(msg_id)) == 404:
+                print(f"🗑️ Mensaje {msg_id} ya no existe en Gmail, se omite")
+                continue
+            yield posicion, msg_id, sobres.get(msg_id), errores.get(msg_id)
+
+
+def pdf_attachments(envelope):
+    """Descriptores de los adjuntos PDF de un sobre"""
+    return [a for a in envelope['attachments'] if a['filename'].lower().endswith('.pdf')]
+
+
+def download_attachment(service, msg_id, adjunto):
+    """
+    Descarga y decodifica un adjunto (o lo lee del cache local). Nunca lanza:
+    retorna (adjunto, bytes|None, error|None) para poder usarse tanto en serie
+    como desde el pool de hilos.
+    """
+    clave = adjunto.get('part_id') or adjunto['filename']
+    cacheado = CACHE.get_attachment(msg_id, clave)
+    if cacheado is not None:
+        return adjunto, cacheado, None
     try:
-        message = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
+        request = service.users().messages().attachments().get(
+            userId='me', messageId=msg_id, id=adjunto['attachment_id'])
+        http = http_hilo(service)
+        attachment = CONTROLADOR.ejecutar('messages.attachments.get', lambda: request.execute(http=http))
     except Exception as e:
-        print(f"⚠️ No se pudo obtener mensaje {msg_id}: {e}")
-        return saved_files
+        return adjunto, None, e
+    data = attachment.get('data')
+    if not data:
+        return adjunto, None, None
+    file_data = base64.urlsafe_b64decode(data)
+    CACHE.put_attachment(msg_id, clave, file_data)
+    return adjunto, file_data, None
 
-    parts = message.get('payload', {}).get('parts', []) or [message.get('payload', {})]
-    for part in parts:
-        filename = part.get('filename', '')
-        if not filename.lower().endswith('.pdf'):
-            continue
-        attach_id = part.get('body', {}).get('attachmentId')
-        if not attach_id:
-            continue
+
+def iter_downloads(service, items, workers=GMAIL_DOWNLOAD_WORKERS):
+    """
+    Etapa de descarga concurrente sobre iter_envelopes: envía al pool los adjuntos PDF
+    de los mensajes siguientes mientras se procesan los actuales (ventana acotada).
+    Genera (posicion, msg_id, sobre, error, descargas) en el mismo orden de entrada;
+    con workers <= 1 descargas es None y save_pdf_attachments descarga en serie.
+    """
+    if workers <= 1:
+        for posicion, msg_id, envelope, error in items:
+            yield posicion, msg_id, envelope, error, None
+        return
+
+    def _resolver(entrada):
+        (posicion, msg_id, envelope, error), futuros = entrada
+        return posicion, msg_id, envelope, error, [f.result() for f in futuros]
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='adjuntos') as pool:
+        en_vuelo = deque()
+        for item in items:
+            _, msg_id, envelope, error = item
+            futuros = [] if error is not None else [
+                pool.submit(download_attachment, service, msg_id, adjunto)
+                for adjunto in pdf_attachments(envelope)
+            ]
+            en_vuelo.append((item, futuros))
+            if len(en_vuelo) > workers * 2:
+                yield _resolver(en_vuelo.popleft())
+        while en_vuelo:
+            yield _resolver(en_vuelo.popleft())
+
+
+def _pdf_descargados(service, msg_id, envelope=None, descargas=None):
+    """
+    Bytes de los adjuntos PDF de un mensaje como [(filename, bytes)], en orden
+    de mensaje (usa `envelope` si ya fue obtenido y `descargas` si ya fueron
+    bajadas por iter_downloads).
+    """
+    if envelope is None:
         try:
-            attachment = service.users().messages().attachments().get(userId='me', messageId=msg_id, id=attach_id).execute()
+            envelope = fetch_envelope(service, msg_id)
         except Exception as e:
-            print(f"⚠️ No se pudo obtener adjunto {attach_id} del mensaje {msg_id}: {e}")
-            continue
-        data = attachment.get('data')
-        if not data:
+            print(f"⚠️ No se pudo obtener mensaje {msg_id}: {e}")
+            return []
+
+    if descargas is None:
+        descargas = [download_attachment(service, msg_id, a) for a in pdf_attachments(envelope)]
+
+    archivos = []
+    for adjunto, file_data, error in descargas:
+        if error is not None:
+            print(f"⚠️ No se pudo obtener adjunto {adjunto['attachment_id']} del mensaje {msg_id}: {error}")
             continue
-        file_data = base64.urlsafe_b64decode(data)
+        if file_data:
+            archivos.append((adjunto['filename'], file_data))
+    return archivos
+
+
+def save_pdf_attachments(service, msg_id, envelope=None, descargas=None):
+    """
+    Guarda adjuntos PDF de un mensaje en PDF_SAVE_DIR. La escritura y el
+    manejo de nombres repetidos ocurren siempre aquí, en orden de mensaje.
+    """
+    saved_files = []
+    for filename, file_data in _pdf_descargados(service, msg_id, envelope, descargas):
         filepath = os.path.join(PDF_SAVE_DIR, filename)
         if os.path.exists(filepath):
             base, ext = os.path.splitext(filename)
@@ -313,47 +468,151 @@ def save_pdf_attachments(service, msg_id):
     return saved_files
 
 
+def load_pdf_attachments(service, msg_id, envelope=None, descargas=None):
+    """
+    Variante en memoria de save_pdf_attachments: retorna [(filename, bytes)]
+    sin escribir en disco (ni nombres _1, _2 ni limpieza posterior).
+    """
+    archivos = _pdf_descargados(service, msg_id, envelope, descargas)
+    for filename, file_data in archivos:
+        print(f"📥 Adjunto en memoria: {filename} ({len(file_data) / 1024:.0f} KB)")
+    return archivos
+
+
+def iter_pdfs(service, descargas):
+    """
+    Agrega a cada mensaje de iter_downloads sus PDFs [(filename, fuente)]:
+    bytes en memoria o rutas en PDF_SAVE_DIR según PDF_EN_MEMORIA.
+    """
+    for i, msg_id, envelope, error, descargas_msg in descargas:
+        pdfs = []
+        if error is None:
+            if PDF_EN_MEMORIA:
+                pdfs = load_pdf_attachments(service, msg_id, envelope=envelope, descargas=descargas_msg)
+            else:
+                pdfs = [(os.path.basename(path), path)
+                        for path in save_pdf_attachments(service, msg_id, envelope=envelope, descargas=descargas_msg)]
+        yield i, msg_id, envelope, error, pdfs
+
+
+def open_pdf(fuente):
+    """Abre un PDF con pdfplumber desde una ruta o desde sus bytes en memoria"""
+    if isinstance(fuente, (bytes, bytearray, memoryview)):
+        fuente = io.BytesIO(fuente)
+    return pdfplumber.open(fuente)
+
+
 # ============ EXTRACCIÓN DE PDF ============
 
+# Patrones de encabezado, por campo en orden de precedencia: gana el primer
+# patrón cuyo primer match da un número válido
+HEADER_PATTERNS = {
+    'SUBTOTAL': [
+        r'SUB[\s-]?TOTAL\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
+        r'SUBTOTAL\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
+        r'Sub\s*Total\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)'
+    ],
+    'descuento_pesos $': [
+        r'descuento[\s_]*pesos?\s*\$?\s*[:\s]*([0-9.,\s]+?)(?=\n|$)',
+        r'DESCUENTO\s*\$?\s*[:\s]*([0-9.,\s]+?)(?=\n|$)'
+    ],
+    'VALOR NETO': [
+        r'VALOR\s+NETO\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
+        r'Valor\s+Neto\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
+        r'NETO\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)'
+    ],
+    'IVA': [
+        r'I\.?V\.?A\.?\s*(?:\([^)]*\))?\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
+        r'IVA\s*19%?\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)'
+    ],
+    'TOTAL': [
+        r'\bTOTAL\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
+        r'Total\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)'
+    ]
+}
+NUMERO_PATTERN = r'(?:Factura|N[oº]|Nro|FACTURA)\s*[:#]?\s*([0-9\-]+)'
+
+_NUMERO_RE = re.compile(NUMERO_PATTERN, re.IGNORECASE)
+_HEADER_RES = {k: [re.compile(p, re.IGNORECASE | re.MULTILINE) for p in lista]
+               for k, lista in HEADER_PATTERNS.items()}
+
+# Etiqueta (en minúsculas) con que empieza cada patrón: solo se prueba un patrón
+# donde aparece alguna de sus etiquetas
+_ETIQUETAS_HEADER = {
+    'factura': [('numero', 0)],
+    'no': [('numero', 0)],
+    'nº': [('numero', 0)],
+    'nro': [('numero', 0)],
+    'sub': [('SUBTOTAL', 0), ('SUBTOTAL', 1), ('SUBTOTAL', 2)],
+    'descuento': [('descuento_pesos $', 0), ('descuento_pesos $', 1)],
+    'valor': [('VALOR NETO', 0), ('VALOR NETO', 1)],
+    'neto': [('VALOR NETO', 2)],
+    'iv': [('IVA', 0), ('IVA', 1)],
+    'i.v': [('IVA', 0)],
+    'total': [('TOTAL', 0), ('TOTAL', 1)],
+}
+# Caracteres que re.IGNORECASE iguala a una letra ASCII pero que str.lower() no convierte
+_PLEGADO_ESPECIAL = ('İ', 'ı', 'ſ')
+
+
+def _patron_header(clave):
+    campo, idx = clave
+    return _NUMERO_RE if campo == 'numero' else _HEADER_RES[campo][idx]
+
+
+def scan_header_matches(text):
+    """
+    Primer match de cada patrón de encabezado: {('numero', 0): match,
+    ('SUBTOTAL', 1): match, ...}, equivalente a un re.search por patrón.
+
+    Pasa el texto a minúsculas una vez, ubica las etiquetas con str.find y
+    prueba cada patrón compilado solo en esas posiciones, en vez de recorrer
+    el texto carácter a carácter una vez por patrón (con IGNORECASE el motor
+    de re no puede saltar al prefijo literal).
+    """
+    bajo = text.lower()
+    if len(bajo) != len(text) or any(c in text for c in _PLEGADO_ESPECIAL):
+        # Las posiciones del texto en minúsculas no sirven: búsqueda directa
+        primeros = {('numero', 0): _NUMERO_RE.search(text)}
+        for campo, patrones in _HEADER_RES.items():
+            for idx, patron in enumerate(patrones):
+                primeros[(campo, idx)] = patron.search(text)
+        return {k: m for k, m in primeros.items() if m}
+
+    posiciones = {}
+    for etiqueta, claves in _ETIQUETAS_HEADER.items():
+        pos = bajo.find(etiqueta)
+        while pos != -1:
+            for clave in claves:
+                posiciones.setdefault(clave, []).append(pos)
+            pos = bajo.find(etiqueta, pos + 1)
+
+    primeros = {}
+    for clave, candidatas in posiciones.items():
+        patron = _patron_header(clave)
+        for pos in sorted(candidatas):
+            m = patron.match(text, pos)
+            if m:
+                primeros[clave] = m
+                break
+    return primeros
+
+
 def extract_header_regex(text):
     """Extrae valores de encabezado de factura usando regex con múltiples patrones"""
     header = {}
+    primeros = scan_header_matches(text)
     
     # Extraer número de factura
-    nro = re.search(r'(?:Factura|N[oº]|Nro|FACTURA)\s*[:#]?\s*([0-9\-]+)', text, re.IGNORECASE)
+    nro = primeros.get(('numero', 0))
     if nro:
         header['numero'] = nro.group(1).strip()
     
-    patterns = {
-        'SUBTOTAL': [
-            r'SUB[\s-]?TOTAL\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
-            r'SUBTOTAL\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
-            r'Sub\s*Total\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)'
-        ],
-        'descuento_pesos $': [
-            r'descuento[\s_]*pesos?\s*\$?\s*[:\s]*([0-9.,\s]+?)(?=\n|$)',
-            r'DESCUENTO\s*\$?\s*[:\s]*([0-9.,\s]+?)(?=\n|$)'
-        ],
-        'VALOR NETO': [
-            r'VALOR\s+NETO\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
-            r'Valor\s+Neto\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
-            r'NETO\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)'
-        ],
-        'IVA': [
-            r'I\.?V\.?A\.?\s*(?:\([^)]*\))?\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
-            r'IVA\s*19%?\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)'
-        ],
-        'TOTAL': [
-            r'\bTOTAL\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
-            r'Total\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)'
-        ]
-    }
-    
     # Intentar cada patrón hasta encontrar match
-    for k, pattern_list in patterns.items():
+    for k, pattern_list in _HEADER_RES.items():
         valor_encontrado = None
-        for pattern in pattern_list:
-            m = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
+        for idx in range(len(pattern_list)):
+            m = primeros.get((k, idx))
             if m:
                 valor_str = m.group(1).strip()
                 valor_encontrado = parse_number(valor_str)
@@ -381,54 +640,356 @@ def extract_header_regex(text):
     return header
 
 
-def extract_items_from_pdf(pdf_path, numero_factura, is_nota=False):
-    """Extrae líneas de items de un PDF"""
-    lineas = []
+class MemoriaExcedida(Exception):
+    """El RSS del proceso creció más que PDF_MAX_RSS_MB durante un documento"""
+
+
+class PDFIlegible(Exception):
+    """La extracción del PDF falló (archivo malformado o que el motor no puede leer)"""
+
+
+def rss_mb():
+    """RSS actual del proceso en MB (0 si no hay /proc, p. ej. fuera de Linux)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        return 0.0
+
+
+class MedidorRSS:
+    """Pico de RSS de un documento (sobre el RSS al empezar), medido página a página"""
+
+    def __init__(self, limite_mb=0):
+        self.limite_mb = limite_mb
+        self.base = rss_mb()
+        self.pico = 0.0
+
+    def medir(self):
+        delta = rss_mb() - self.base
+        self.pico = max(self.pico, delta)
+        if self.limite_mb and delta > self.limite_mb:
+            raise MemoriaExcedida(f"+{delta:.0f} MB de RSS (límite {self.limite_mb} MB)")
+
+
+def _texto_paginas(pdf, medidor=None):
+    # page.close() suelta los caches de objetos de cada página: sin eso el
+    # handle del PDF los retiene todos y la memoria crece con las páginas
+    paginas = []
+    for page in pdf.pages:
+        paginas.append(page.extract_text() or "")
+        page.close()
+        if medidor:
+            medidor.medir()
+    return paginas
+
+
+def _paginas_pdfplumber(fuente, medidor=None):
+    with open_pdf(fuente) as pdf:
+        return _texto_paginas(pdf, medidor)
+
+
+def _paginas_pypdfium2(fuente, medidor=None):
+    pdf = pdfium.PdfDocument(bytes(fuente) if isinstance(fuente, (bytearray, memoryview)) else fuente)
+    try:
+        paginas = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            text = textpage.get_text_bounded()
+            textpage.close()
+            page.close()
+            # pdfium separa renglones con \r\n; pdfplumber con \n y sin espacios al final
+            renglones = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+            paginas.append('\n'.join(r.rstrip() for r in renglones).strip('\n'))
+            if medidor:
+                medidor.medir()
+        return paginas
+    finally:
+        pdf.close()
+
+
+BACKENDS_PDF = {
+    'pdfplumber': _paginas_pdfplumber,
+    'pypdfium2': _paginas_pypdfium2,
+}
+
+
+def extract_pages_text(fuente, backend=None, medidor=None):
+    """
+    Texto de cada página de un PDF (ruta o bytes) con el motor indicado
+    (PDF_BACKEND por defecto). La extracción es lo costoso: hacerla una vez.
+    Con `medidor` (MedidorRSS) se mide la memoria tras cada página.
+    """
+    backend = backend or PDF_BACKEND
+    if backend not in BACKENDS_PDF:
+        raise ValueError(f"Motor de PDF desconocido: {backend} (opciones: {', '.join(BACKENDS_PDF)})")
+    return BACKENDS_PDF[backend](fuente, medidor)
+
+
+def extract_items_from_text(paginas, numero_factura, is_nota=False):
+    """Extrae líneas de items desde el texto ya extraído de cada página"""
+    return parse_lineas(paginas, numero_factura, is_nota)
+
+
+def extract_items_from_pdf(pdf_path, numero_factura, is_nota=False, backend=None):
+    """Extrae líneas de items de un PDF (ruta o bytes en memoria)"""
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                text = page.extract_text() or ""
-                pattern = re.compile(
-                    r'^\s*(\d{1,3})\s+'  
-                    r'([A-Za-z0-9\-\.\/_]+?)\s+'  
-                    r'(.+?)\s+'  
-                    r'(\d+(?:[.,]\d+)?)\s+'  
-                    r'([\d.,]+)\s+'  
-                    r'([\d.,]+%?)?'  
-                    r'\s+([\d.,]+)\s*$',  
-                    re.MULTILINE
-                )
-                for match in pattern.finditer(text):
-                    desc = limpiar_prefijo_numerico(match.group(3).strip())
-                    cantidad_raw = parse_number(match.group(4))
-                    cantidad = int(cantidad_raw) if cantidad_raw and float(cantidad_raw).is_integer() else cantidad_raw
-
-                    entrada = {
-                        ('numerofactura' if not is_nota else 'numeronota'): str(numero_factura),
-                        'linea_numero': int(match.group(1)),
-                        'descripcion': desc,
-                        'cantidad': cantidad,
-                        'precio_unitario': parse_number(match.group(5)),
-                        'descuento_pesos_porcentaje': parse_number(match.group(6)),
-                        'total_linea': parse_number(match.group(7)),
-                    }
-                    lineas.append(entrada)
+        return extract_items_from_text(extract_pages_text(pdf_path, backend), numero_factura, is_nota)
     except Exception as e:
-        print(f"❌ Error leyendo PDF {pdf_path}: {e}")
-    return lineas
+        nombre = pdf_path if isinstance(pdf_path, str) else f"en memoria ({numero_factura})"
+        print(f"❌ Error leyendo PDF {nombre}: {e}")
+        return []
 
 
-# ============ PERSISTENCIA ============
+def unir_paginas(paginas):
+    """Texto completo del documento tal como lo recibe extract_header_regex"""
+    return ''.join(p + "\n" for p in paginas)
+
+
+class DocumentoPDF:
+    """Resultado del parseo de un PDF: texto por página, encabezado y líneas de items"""
+
+    def __init__(self, filename, paginas, header, numero, is_nota, lineas, extraccion='completa'):
+        self.filename = filename
+        self.paginas = paginas
+        self.header = header
+        self.numero = numero
+        self.is_nota = is_nota
+        self.lineas = lineas
+        self.extraccion = extraccion  # 'completa', 'recorte' (regiones), 'liviano' (por memoria) o 'cache'
+        self.categoria = None
+        self.subcategoria = None
+        self.pico_rss_mb = 0.0  # crecimiento máximo del RSS al extraerlo
+
+    @property
+    def texto(self):
+        return unir_paginas(self.paginas)
+
+
+def _documento(filename, paginas, extraccion='completa'):
+    header = extract_header_regex(unir_paginas(paginas))
+    numero = header.get('numero') or filename.split('.')[0]
+    is_nota = "nota" in filename.lower()
+    lineas = extract_items_from_text(paginas, numero, is_nota=is_nota)
+    return DocumentoPDF(filename, paginas, header, numero, is_nota, lineas, extraccion)
+
+
+def _extraer_documento(fuente, filename, backend):
+    """_extraer_con_tope; cualquier error de la extracción se entrega como PDFIlegible"""
+    try:
+        return _extraer_con_tope(fuente, filename, backend)
+    except Exception as e:
+        raise PDFIlegible(f"{type(e).__name__}: {e}") from e
+
+
+def _extraer_con_tope(fuente, filename, backend):
+    """
+    Con PDF_RECORTE y pdfplumber, si hay plantilla para el tipo de documento
+    extrae solo sus regiones; si el resultado no calza con la plantilla, usa
+    las páginas completas del mismo PDF abierto.
+
+    Si el documento hace crecer el RSS más de PDF_MAX_RSS_MB, se abandona y
+    se extrae de nuevo con el motor liviano (PDF_BACKEND_LIVIANO).
+    """
+    medidor = MedidorRSS(PDF_MAX_RSS_MB if backend != PDF_BACKEND_LIVIANO else 0)
+    try:
+        doc = _extraer_con_motor(fuente, filename, backend, medidor)
+    except MemoriaExcedida as e:
+        print(f"⚠️ {filename}: {e}, se extrae con {PDF_BACKEND_LIVIANO}")
+        liviano = MedidorRSS()
+        doc = _documento(filename, extract_pages_text(fuente, PDF_BACKEND_LIVIANO, liviano), 'liviano')
+        doc.pico_rss_mb = max(medidor.pico, liviano.pico)
+        return doc
+    doc.pico_rss_mb = medidor.pico
+    return doc
+
+
+def _extraer_con_motor(fuente, filename, backend, medidor):
+    tipo = 'nota' if "nota" in filename.lower() else 'factura'
+    plantilla = plantilla_documento(tipo) if PDF_RECORTE and backend == 'pdfplumber' else None
+    if not plantilla:
+        return _documento(filename, extract_pages_text(fuente, backend, medidor))
+
+    with open_pdf(fuente) as pdf:
+        doc = _documento(filename, paginas_recortadas(pdf, plantilla), 'recorte')
+        medidor.medir()
+        if plantilla_coincide(doc, plantilla):
+            return doc
+        paginas = _texto_paginas(pdf, medidor)
+    return _documento(filename, paginas)
+
+
+def _documento_cacheado(filename, header, lineas):
+    """DocumentoPDF desde el cache: el número (y con él las líneas) depende del nombre de archivo"""
+    numero = header.get('numero') or filename.split('.')[0]
+    is_nota = "nota" in filename.lower()
+    clave = 'numeronota' if is_nota else 'numerofactura'
+    lineas = [{clave: str(numero), **linea} for linea in lineas]
+    return DocumentoPDF(filename, [], header, numero, is_nota, lineas, 'cache')
+
 
-def write_jsonl(path, rows):
-    """Escribe filas en formato JSONL"""
-    if not rows:
-        print(f"⚠️ No hay filas para {os.path.basename(path)}")
+def _version_parseo(filename, backend):
+    """
+    Versión del parseo para CACHE_PARSEO: parser, motor y modo de extracción.
+    Con recorte incluye una huella de la plantilla, así activar o desactivar
+    PDF_RECORTE o aprender plantillas nuevas no reutiliza resultados de otro modo.
+    """
+    tipo = 'nota' if "nota" in filename.lower() else 'factura'
+    plantilla = plantilla_documento(tipo) if PDF_RECORTE and backend == 'pdfplumber' else None
+    if not plantilla:
+        return f"{PARSER_VERSION}/{backend}"
+    huella = hashlib.sha256(json.dumps(plantilla, sort_keys=True).encode()).hexdigest()[:12]
+    return f"{PARSER_VERSION}/{backend}/recorte-{huella}"
+
+
+def parse_pdf(fuente, filename, backend=None):
+    """
+    Abre el PDF una sola vez, extrae el texto de cada página y alimenta con él
+    tanto a extract_header_regex como a la extracción de líneas.
+
+    Si el mismo contenido ya se parseó con esta versión del parser, motor y
+    modo de extracción, devuelve el resultado guardado en CACHE_PARSEO sin
+    abrir el PDF. Lo extraído con el motor liviano (por memoria) no se guarda.
+    """
+    backend = backend or PDF_BACKEND
+    if not CACHE_PARSEO.activo:
+        return _extraer_documento(fuente, filename, backend)
+
+    digest, version = sha256_pdf(fuente), _version_parseo(filename, backend)
+    guardado = CACHE_PARSEO.get(digest, version)
+    if guardado:
+        return _documento_cacheado(filename, *guardado)
+
+    doc = _extraer_documento(fuente, filename, backend)
+    if doc.extraccion == 'liviano':
+        return doc
+    clave = 'numeronota' if doc.is_nota else 'numerofactura'
+    CACHE_PARSEO.put(digest, version, doc.header,
+                     [{k: v for k, v in linea.items() if k != clave} for linea in doc.lineas])
+    return doc
+
+
+# PDFs abandonados en esta corrida (para el resumen)
+pdfs_abandonados = []
+
+
+def registrar_pdf_fallido(msg_id, filename, fuente, motivo):
+    """
+    Anota en PDFS_FALLIDOS_FILE un PDF abandonado. El mensaje igual queda
+    procesado (para no trabar la corrida diaria en el mismo PDF): para
+    reintentarlo, quitar su msg_id de processed_messages.json.
+    """
+    registro = {'msg_id': msg_id, 'filename': filename, 'sha256': sha256_pdf(fuente),
+                'motivo': motivo, 'fecha': datetime.now().isoformat(timespec='seconds')}
+    with open(PDFS_FALLIDOS_FILE, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    pdfs_abandonados.append(registro)
+    print(f"☠️ {filename} abandonado ({motivo}), anotado en {PDFS_FALLIDOS_FILE}")
+
+
+def _documentos_listos(item, tareas):
+    """
+    (item, documentos) con los resultados de `tareas` [(filename, fuente,
+    obtener)]. Un PDF cuyo parseo falla por el PDF mismo (malformado, tiempo
+    máximo, proceso caído) se anota en la lista de fallidos y el resto sigue.
+    Cualquier otro error deja el item con error: el mensaje cuenta como
+    fallido y se reintenta en la próxima corrida.
+    """
+    documentos = []
+    for filename, fuente, obtener in tareas:
+        try:
+            documentos.append(obtener())
+        except (TareaAbandonada, PDFIlegible) as e:
+            registrar_pdf_fallido(item[1], filename, fuente, str(e))
+        except Exception as e:
+            if item[3] is None:
+                item = (*item[:3], f"parseo de {filename}: {type(e).__name__}: {e}", item[4])
+    return item, documentos
+
+
+def iter_parseos(items, workers=PDF_PARSE_WORKERS, limite_s=PDF_TIMEOUT_S):
+    """
+    Parsea los PDFs de cada item `(..., pdfs)` en un pool de procesos, con una
+    ventana acotada de mensajes en vuelo. Entrega `(item, documentos)` en el
+    mismo orden de entrada, así la salida JSONL es determinista.
+
+    Cada PDF tiene `limite_s` segundos: si los supera, su proceso muere o su
+    extracción falla, queda en la lista de fallidos y el resto del lote sigue.
+    """
+    if workers <= 1 and not limite_s:
+        for item in items:
+            yield _documentos_listos(item, [(filename, fuente, lambda f=fuente, n=filename: parse_pdf(f, n))
+                                            for filename, fuente in item[-1]])
         return
-    with open(path, 'w', encoding='utf-8') as f:
-        for r in rows:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
-    print(f"✅ Generado: {path} ({len(rows)} filas)")
+
+    workers = max(1, workers)
+    with PoolAislado(parse_pdf, workers, limite_s) as pool:
+        ventana = deque()
+        for item in items:
+            ventana.append((item, [(filename, fuente, pool.submit(fuente, filename).result)
+                                   for filename, fuente in item[-1]]))
+            if len(ventana) >= workers * 2:
+                yield _documentos_listos(*ventana.popleft())
+        while ventana:
+            yield _documentos_listos(*ventana.popleft())
+
+
+def iter_clasificados(parseados, reglas):
+    """Clasifica con la librería las líneas de cada documento de `(item, documentos)`"""
+    for item, documentos in parseados:
+        for doc in documentos:
+            doc.categoria, doc.subcategoria = clasificar_lineas_factura(doc.lineas, reglas)
+            for linea in doc.lineas:
+                linea['clasificacion_categoria'] = doc.categoria
+                linea['clasificacion_subcategoria'] = doc.subcategoria
+        yield item, documentos
+
+
+def fila_documento(doc, fecha_iso):
+    """Fila de facturas.jsonl / notas.jsonl para un documento parseado"""
+    return {
+        ("numeronota" if doc.is_nota else "numerofactura"): str(doc.numero),
+        "fechaemision": fecha_iso,
+        "subtotal": doc.header.get('SUBTOTAL'),
+        "descuento_pesos": doc.header.get('descuento_pesos $'),
+        "valorneto": doc.header.get('VALOR NETO'),
+        "iva": doc.header.get('IVA'),
+        "total": doc.header.get('TOTAL'),
+        "cantidad_lineas": len(doc.lineas)
+    }
+
+
+# ============ PERSISTENCIA ============
+
+class EscritorJSONL:
+    """
+    Escribe filas JSONL a medida que llegan. No crea el archivo si no hay
+    filas: se abre (truncado) con la primera.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.filas = 0
+        self._f = None
+
+    def escribir(self, filas):
+        for r in filas:
+            if self._f is None:
+                self._f = open(self.path, 'w', encoding='utf-8')
+            self._f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            self.filas += 1
+
+    def flush(self):
+        if self._f is not None:
+            self._f.flush()
+
+    def cerrar(self):
+        if self._f is None:
+            print(f"⚠️ No hay filas para {os.path.basename(self.path)}")
+            return
+        self._f.close()
+        self._f = None
+        print(f"✅ Generado: {self.path} ({self.filas} filas)")
 
 
 def read_last_date():
@@ -464,6 +1025,7 @@ def save_processed_msgs(s):
 # ============ MAIN ============
 
 def main():
+    inicio = time.perf_counter()
     print("=" * 60)
     print("🚀 Extracción de Facturas Rodenstock - Versión 2.0")
     print("=" * 60)
@@ -475,8 +1037,12 @@ def main():
     reglas = cargar_libreria()
     
     # Autenticar Gmail
-    print("\n📧 Autenticando con Gmail...")
-    service = authenticate_gmail()
+    if GMAIL_FAKE:
+        from gmail_simulado import crear_servicio
+        service = crear_servicio(GMAIL_FAKE)
+    else:
+        print("\n📧 Autenticando con Gmail...")
+        service = authenticate_gmail()
     
     # Leer estado previo
     last_date = read_last_date()
@@ -484,112 +1050,129 @@ def main():
     print(f"📅 Última fecha procesada: {last_date}")
     print(f"📧 Mensajes ya procesados: {len(processed_msgs)}")
 
-    # Construir query
-    query = f'{BASE_QUERY} after:{last_date.replace("-", "/")}'
-    print(f"\n🔍 Query usado: {query}")
-
     # Obtener mensajes
-    msgs = get_all_messages(service, query)
-    print(f"📧 Mensajes encontrados: {len(msgs)}")
+    history_id = read_history_id(HISTORY_ID_FILE) if GMAIL_SYNC_MODE == 'history' else None
+    msgs, new_history_id, modo = sync_messages(service, BASE_QUERY, last_date, history_id, processed_msgs,
+                                               checkpoint=GMAIL_SYNC_MODE == 'history')
+    if modo == 'history':
+        print(f"\n🔍 Modo history: cambios desde historyId {history_id}")
+    else:
+        print(f"\n🔍 Modo query: {BASE_QUERY} after:{last_date.replace('-', '/')}")
+    print(f"📧 Mensajes encontrados: {len(msgs)} (modo {modo})")
+    mensajes_fallidos = 0
+    mensajes_procesados = 0
+    extracciones = {'completa': 0, 'recorte': 0, 'liviano': 0, 'cache': 0}
+    # Pico de RSS por PDF: solo agregados, para no acumular nada por documento
+    pico_rss = {'max': 0.0, 'suma': 0.0, 'pdfs': 0}
 
-    facturas, lineas_factura, notas, lineas_notas = [], [], [], []
     new_last_date = last_date
 
+    # Mensajes pendientes (sin duplicados: un batch no admite request_id repetidos)
+    pendientes, vistos = [], set()
     for i, m in enumerate(msgs, 1):
-        msg_id = m['id']
-        if msg_id in processed_msgs:
+        if m['id'] in processed_msgs or m['id'] in vistos:
             continue
+        vistos.add(m['id'])
+        pendientes.append((i, m['id']))
 
-        print(f"\n[{i}/{len(msgs)}] Procesando mensaje {msg_id}...")
-        
-        pdfs = save_pdf_attachments(service, msg_id)
-        if not pdfs:
-            print(f"⚠️ No se procesaron PDFs para el mensaje {msg_id}")
-            continue
+    sobres = iter_envelopes(service, pendientes)
+    if modo == 'history':
+        # La History API no filtra por remitente como BASE_QUERY: descartar antes de descargar
+        sobres = (item for item in sobres
+                  if item[3] is not None or REMITENTE in (item[2]['headers'].get('From') or '').lower())
+
+    # Mensajes → PDFs → documentos parseados → clasificados → JSONL incremental.
+    # Las filas de cada mensaje se escriben juntas y con flush: si la corrida
+    # se cae, lo ya escrito queda completo (Cargar es idempotente por número)
+    mensajes = iter_pdfs(service, iter_downloads(service, sobres))
+    clasificados = iter_clasificados(iter_parseos(mensajes), reglas)
+    salidas = {nombre: EscritorJSONL(os.path.join(OUTPUT_DIR, f"{nombre}.jsonl"))
+               for nombre in ('facturas', 'lineas_factura', 'notas', 'lineas_notas')}
+    try:
+        for (i, msg_id, envelope, error, pdfs), documentos in clasificados:
+            print(f"\n[{i}/{len(msgs)}] Procesando mensaje {msg_id}...")
+
+            if error is not None:
+                print(f"⚠️ No se pudo procesar mensaje {msg_id}: {error}")
+                mensajes_fallidos += 1
+                continue
+
+            if not pdfs:
+                print(f"⚠️ No se procesaron PDFs para el mensaje {msg_id}")
+                if pdf_attachments(envelope):
+                    mensajes_fallidos += 1
+                continue
+
+            date_header = envelope['headers'].get('Date')
+            if not date_header:
+                continue
+            dt = parsedate_to_datetime(date_header)
+            fecha_iso = dt.strftime('%Y-%m-%d')
+
+            filas = {nombre: [] for nombre in salidas}
+            for doc in documentos:
+                if doc.extraccion == 'cache':
+                    print(f"  📄 Procesando: {doc.filename}")
+                else:
+                    print(f"  📄 Procesando: {doc.filename} (pico RSS +{doc.pico_rss_mb:.0f} MB)")
+                    pico_rss['max'] = max(pico_rss['max'], doc.pico_rss_mb)
+                    pico_rss['suma'] += doc.pico_rss_mb
+                    pico_rss['pdfs'] += 1
+                print(f"  ✅ Clasificado como: {doc.categoria} - {doc.subcategoria}")
+                extracciones[doc.extraccion] += 1
+                if doc.is_nota:
+                    filas['notas'].append(fila_documento(doc, fecha_iso))
+                    filas['lineas_notas'].extend(doc.lineas)
+                else:
+                    filas['facturas'].append(fila_documento(doc, fecha_iso))
+                    filas['lineas_factura'].extend(doc.lineas)
+            for nombre, salida in salidas.items():
+                salida.escribir(filas[nombre])
+                salida.flush()
 
-        msg = None
-        try:
-            msg = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-        except Exception as e:
-            print(f"⚠️ No se pudo obtener mensaje {msg_id}: {e}")
             processed_msgs.add(msg_id)
-            continue
+            mensajes_procesados += 1
+            if fecha_iso > new_last_date:
+                new_last_date = fecha_iso
 
-        date_header = next((h['value'] for h in msg.get('payload', {}).get('headers', []) if h.get('name') == 'Date'), None)
-        if not date_header:
-            continue
-        dt = parsedate_to_datetime(date_header)
-        fecha_iso = dt.strftime('%Y-%m-%d')
-
-        for pdf_path in pdfs:
-            filename = os.path.basename(pdf_path)
-            print(f"  📄 Procesando: {filename}")
-            
-            with pdfplumber.open(pdf_path) as pdf:
-                text = ''.join([(p.extract_text() or "") + "\n" for p in pdf.pages])
-            
-            header = extract_header_regex(text)
-            numero = header.get('numero') or filename.split('.')[0]
-            is_nota = "nota" in filename.lower()
-
-            lineas = extract_items_from_pdf(pdf_path, numero, is_nota=is_nota)
-            
-            # CLASIFICAR LAS LÍNEAS USANDO LA LIBRERÍA
-            categoria, subcategoria = clasificar_lineas_factura(lineas, reglas)
-            print(f"  ✅ Clasificado como: {categoria} - {subcategoria}")
-            
-            # Asignar clasificación a cada línea
-            for linea in lineas:
-                linea['clasificacion_categoria'] = categoria
-                linea['clasificacion_subcategoria'] = subcategoria
-
-            if is_nota:
-                notas.append({
-                    "numeronota": str(numero),
-                    "fechaemision": fecha_iso,
-                    "subtotal": header.get('SUBTOTAL'),
-                    "descuento_pesos": header.get('descuento_pesos $'),
-                    "valorneto": header.get('VALOR NETO'),
-                    "iva": header.get('IVA'),
-                    "total": header.get('TOTAL'),
-                    "cantidad_lineas": len(lineas)
-                })
-                lineas_notas.extend(lineas)
-            else:
-                facturas.append({
-                    "numerofactura": str(numero),
-                    "fechaemision": fecha_iso,
-                    "subtotal": header.get('SUBTOTAL'),
-                    "descuento_pesos": header.get('descuento_pesos $'),
-                    "valorneto": header.get('VALOR NETO'),
-                    "iva": header.get('IVA'),
-                    "total": header.get('TOTAL'),
-                    "cantidad_lineas": len(lineas)
-                })
-                lineas_factura.extend(lineas)
-
-        processed_msgs.add(msg_id)
-        if fecha_iso > new_last_date:
-            new_last_date = fecha_iso
-
-    print("\n" + "=" * 60)
-    print("📊 RESUMEN DE PROCESAMIENTO")
-    print("=" * 60)
-    print(f"Facturas: {len(facturas)}")
-    print(f"Líneas de factura: {len(lineas_factura)}")
-    print(f"Notas de crédito: {len(notas)}")
-    print(f"Líneas de notas: {len(lineas_notas)}")
-
-    # Escribir archivos JSONL
-    print("\n💾 Generando archivos JSONL...")
-    write_jsonl(os.path.join(OUTPUT_DIR, "facturas.jsonl"), facturas)
-    write_jsonl(os.path.join(OUTPUT_DIR, "lineas_factura.jsonl"), lineas_factura)
-    write_jsonl(os.path.join(OUTPUT_DIR, "notas.jsonl"), notas)
-    write_jsonl(os.path.join(OUTPUT_DIR, "lineas_notas.jsonl"), lineas_notas)
+        print("\n" + "=" * 60)
+        print("📊 RESUMEN DE PROCESAMIENTO")
+        print("=" * 60)
+        print(f"Facturas: {salidas['facturas'].filas}")
+        print(f"Líneas de factura: {salidas['lineas_factura'].filas}")
+        print(f"Notas de crédito: {salidas['notas'].filas}")
+        print(f"Líneas de notas: {salidas['lineas_notas'].filas}")
+        print("\n💾 Cerrando archivos JSONL...")
+    finally:
+        for salida in salidas.values():
+            salida.cerrar()
+
+    print(f"📡 Gmail API: {CONTROLADOR.resumen()}")
+    if CACHE.activo:
+        print(f"🗄️ Cache Gmail: {CACHE.resumen()}")
+    if CACHE_PARSEO.activo:
+        print(f"🧾 Cache de parseo: {extracciones['cache']} PDFs sin reparsear, {CACHE_PARSEO.resumen()}")
+    if PDF_RECORTE:
+        print(f"✂️ Extracción por regiones: {extracciones['recorte']} PDFs, "
+              f"página completa: {extracciones['completa']}")
+    print(f"🏷️ Memo de clasificación: {MEMO_CLASIFICACION.resumen()}")
+    if pdfs_abandonados:
+        print(f"☠️ PDFs abandonados: {len(pdfs_abandonados)} (ver {PDFS_FALLIDOS_FILE})")
+    if pico_rss['pdfs']:
+        print(f"🧠 Pico RSS por PDF: máx +{pico_rss['max']:.0f} MB, "
+              f"promedio +{pico_rss['suma'] / pico_rss['pdfs']:.1f} MB, "
+              f"{extracciones['liviano']} con {PDF_BACKEND_LIVIANO} por superar {PDF_MAX_RSS_MB} MB")
 
     # Guardar estado
     save_last_date(new_last_date)
     save_processed_msgs(processed_msgs)
+    # Con mensajes fallidos no se avanza el checkpoint: la próxima corrida los vuelve a ver
+    if GMAIL_SYNC_MODE == 'history' and new_history_id and not mensajes_fallidos:
+        save_history_id(new_history_id, HISTORY_ID_FILE)
+
+    duracion = time.perf_counter() - inicio
+    print(f"⏱️ {mensajes_procesados} mensajes en {duracion:.1f}s "
+          f"({mensajes_procesados / duracion if duracion else 0:.1f} mensajes/s)")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,67 +1,124 @@
 #!/usr/bin/env python3
+"""
+Recategoriza en la BD las líneas de facturas y notas con la librería actual.
+
+Tras una recategorización se guarda una foto de las reglas usadas y del
+último id de línea de cada tabla (RECATEGORIZADO_FILE). La siguiente corrida
+compara esa foto con la librería actual y solo reclasifica:
+  - los documentos cuyo texto contiene algún texto de una regla agregada,
+    quitada, modificada o movida (motor_reglas.textos_cambiados);
+  - los documentos con líneas cargadas después de la foto.
+El resultado es el mismo que recategorizar todo (--completa).
+"""
+import argparse
+import json
 import sys
 import os
 import sqlite3
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from scripts.Procesar import cargar_libreria, clasificar_lineas_factura
+# motor_reglas se importa por nombre de módulo, igual que desde Procesar (un solo MEMO_CLASIFICACION)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from scripts.Procesar import cargar_libreria, clasificar_lineas_factura, texto_factura
+from motor_reglas import GRUPOS, MEMO_CLASIFICACION, MIN_TEXTOS_AUTOMATA, AhoCorasick, textos_cambiados
 
 DB_FILE = "data/facturas.db"
+RECATEGORIZADO_FILE = "data/libreria_recategorizada.json"
+TABLAS = (('lineas_factura', 'numerofactura'), ('lineas_notas', 'numeronota'))
+
+
+def leer_foto(ruta=RECATEGORIZADO_FILE):
+    """{'reglas': {...}, 'max_id': {...}} de la última recategorización, o None"""
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def guardar_foto(reglas, max_id, ruta=RECATEGORIZADO_FILE):
+    foto = {'reglas': {grupo: reglas[grupo] for grupo, _ in GRUPOS}, 'max_id': max_id}
+    temporal = f"{ruta}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(foto, f, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+
+def _contiene_alguno(textos):
+    """Función texto → True si contiene alguno de `textos` (None si no hay textos)"""
+    textos = list(textos)
+    if not textos:
+        return None
+    if len(textos) >= MIN_TEXTOS_AUTOMATA:
+        return AhoCorasick(textos).buscar
+    return lambda texto: any(t in texto for t in textos)
+
 
-def recategorizar_db():
+def recategorizar_tabla(cursor, tabla, columna, reglas, afectado=None, desde_id=None):
+    """
+    Reclasifica los documentos de `tabla`: todos, o con `desde_id` solo los
+    que tienen alguna línea con id > desde_id o cuyo texto cumple `afectado`
+    (texto → bool, opcional). Devuelve (documentos, líneas actualizadas).
+    """
+    cursor.execute(f"SELECT id, {columna}, descripcion FROM {tabla}")
+    docs = {}
+    for id_linea, numero, desc in cursor.fetchall():
+        docs.setdefault(numero, []).append({"id": id_linea, "descripcion": desc})
+
+    documentos, actualizaciones = 0, 0
+    for numero, lineas in docs.items():
+        texto = None
+        if desde_id is not None and not any(linea["id"] > desde_id for linea in lineas):
+            if afectado is None or not afectado(texto := texto_factura(lineas)):
+                continue
+        cat, subcat = clasificar_lineas_factura(lineas, reglas, texto)
+        cursor.executemany(f"UPDATE {tabla} SET clasificacion_categoria=?, clasificacion_subcategoria=? WHERE id=?",
+                           [(cat, subcat, linea["id"]) for linea in lineas])
+        documentos += 1
+        actualizaciones += len(lineas)
+    return documentos, actualizaciones
+
+
+def recategorizar_db(completa=False):
     if not os.path.exists(DB_FILE):
         print(f"❌ Base de datos no encontrada: {DB_FILE}")
         return
 
-    print("🔄 Recategorizando base de datos completa...")
     reglas = cargar_libreria()
+    foto = None if completa else leer_foto()
+    afectado = None
+    if foto is None:
+        print("🔄 Recategorizando base de datos completa...")
+    else:
+        cambiados = textos_cambiados(foto['reglas'], reglas)
+        print(f"🔄 Recategorización incremental: {len(cambiados)} textos de reglas cambiaron desde la anterior")
+        afectado = _contiene_alguno(cambiados)
+
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
-
-    # == 1. FACTURAS ==
-    cursor.execute("SELECT id, numerofactura, descripcion FROM lineas_factura")
-    todas_lineas = cursor.fetchall()
-    
-    # Agrupar por factura
-    docs_facturas = {}
-    for id_linea, numero, desc in todas_lineas:
-        if numero not in docs_facturas:
-            docs_facturas[numero] = []
-        docs_facturas[numero].append({"id": id_linea, "descripcion": desc})
-
-    actualizaciones_f = 0
-    for numero, lineas in docs_facturas.items():
-        cat, subcat = clasificar_lineas_factura(lineas, reglas)
-        for linea in lineas:
-            cursor.execute("UPDATE lineas_factura SET clasificacion_categoria=?, clasificacion_subcategoria=? WHERE id=?", 
-                           (cat, subcat, linea["id"]))
-            actualizaciones_f += 1
-
-    # == 2. NOTAS DE CRÉDITO ==
-    cursor.execute("SELECT id, numeronota, descripcion FROM lineas_notas")
-    todas_notas = cursor.fetchall()
-    
-    docs_notas = {}
-    for id_linea, numero, desc in todas_notas:
-        if numero not in docs_notas:
-            docs_notas[numero] = []
-        docs_notas[numero].append({"id": id_linea, "descripcion": desc})
-
-    actualizaciones_n = 0
-    for numero, lineas in docs_notas.items():
-        cat, subcat = clasificar_lineas_factura(lineas, reglas)
-        for linea in lineas:
-            cursor.execute("UPDATE lineas_notas SET clasificacion_categoria=?, clasificacion_subcategoria=? WHERE id=?", 
-                           (cat, subcat, linea["id"]))
-            actualizaciones_n += 1
-
+    max_id = {tabla: cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {tabla}").fetchone()[0]
+              for tabla, _ in TABLAS}
+    resultados = {
+        tabla: recategorizar_tabla(cursor, tabla, columna, reglas, afectado,
+                                   foto and foto['max_id'].get(tabla, 0))
+        for tabla, columna in TABLAS
+    }
     conn.commit()
     conn.close()
+    guardar_foto(reglas, max_id)
+
+    (docs_f, actualizaciones_f), (docs_n, actualizaciones_n) = resultados['lineas_factura'], resultados['lineas_notas']
     print(f"✅ Se han recategorizado {actualizaciones_f} líneas de faturas y {actualizaciones_n} líneas de notas de crédito directamente en la BD.")
+    print(f"📄 Documentos reclasificados: {docs_f} facturas, {docs_n} notas")
+    print(f"🏷️ Memo de clasificación: {MEMO_CLASIFICACION.resumen()}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recategoriza la BD con la librería actual")
+    parser.add_argument('--completa', action='store_true',
+                        help="Reclasificar todos los documentos aunque haya foto de la recategorización anterior")
+    args = parser.parse_args()
+
     print("="*60)
     print("🚀 INICIANDO RECATEGORIZACIÓN EN BD HISTÓRICA")
     print("="*60)
-    recategorizar_db()
+    recategorizar_db(completa=args.completa)
     print("✅ LISTO. No es necesario ejecutar Cargar.py.")
@@ -23,6 +23,8 @@ from datetime import datetime
 # ============ DETECCIÓN DE ENTORNO ============
 IS_GITHUB_ACTIONS = os.getenv('GITHUB_ACTIONS') == 'true'
 IS_CI = os.getenv('CI') == 'true' or IS_GITHUB_ACTIONS
+# Gmail simulado (benchmarks sin red): no usa credenciales ni toca la BD ni el estado reales
+IS_GMAIL_FAKE = bool(os.getenv('GMAIL_FAKE'))
 
 # ============ CONFIGURACIÓN DE RUTAS ============
 # Detectar si estamos en scripts/ o en raíz del proyecto
@@ -40,12 +42,14 @@ else:
 # Directorios del proyecto
 SCRIPTS_DIR = BASE_DIR / "scripts"
 DATA_DIR = BASE_DIR / "data"
-OUTPUT_DIR = BASE_DIR / "outputs"
+OUTPUT_DIR = BASE_DIR / ("outputs_simulado" if IS_GMAIL_FAKE else "outputs")
 PDF_SAVE_DIR = BASE_DIR / "pdf_attachments"
 
-# Archivos de estado (en raíz del proyecto)
-LAST_PROCESSED_FILE = BASE_DIR / "last_processed.txt"
-PROCESSED_MSGS_FILE = BASE_DIR / "processed_messages.json"
+# Archivos de estado (en raíz del proyecto; en modo simulado junto a sus salidas)
+STATE_DIR = OUTPUT_DIR if IS_GMAIL_FAKE else BASE_DIR
+LAST_PROCESSED_FILE = STATE_DIR / "last_processed.txt"
+PROCESSED_MSGS_FILE = STATE_DIR / "processed_messages.json"
+HISTORY_ID_FILE = STATE_DIR / "last_history_id.txt"
 
 # Archivos de configuración (en raíz del proyecto)
 TOKEN_FILE = BASE_DIR / "token.json"
@@ -55,7 +59,7 @@ CREDENTIALS_FILE = BASE_DIR / "config" / "credentials.json"
 
 # Archivos de datos
 LIBRERIA_FILE = SCRIPTS_DIR / "libreria.xlsx"
-DATABASE_FILE = DATA_DIR / "facturas.db"
+DATABASE_FILE = DATA_DIR / ("facturas_simulado.db" if IS_GMAIL_FAKE else "facturas.db")
 
 
 # ============ SETUP DE CREDENCIALES (GitHub Actions) ============
@@ -64,6 +68,10 @@ def setup_credentials():
     Configura credenciales desde GitHub Secrets si estamos en CI.
     En local, usa los archivos existentes.
     """
+    if IS_GMAIL_FAKE:
+        print(f"🧪 Modo GMAIL SIMULADO ({os.getenv('GMAIL_FAKE')}) - sin credenciales")
+        return
+    
     if not IS_CI:
         print("🔧 Modo LOCAL - usando archivos de credenciales existentes")
         
@@ -203,6 +211,10 @@ def cargar_a_base():
     
     # Ejecutar las funciones de Cargar.py
     try:
+        # Misma BD que verifica/resume este script (facturas_simulado.db en modo simulado)
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        Cargar.DB_FILE = str(DATABASE_FILE)
+        
         # Crear tablas si no existen
         Cargar.crear_tablas()
         
@@ -296,8 +308,13 @@ def verificar_prerequisitos():
     else:
         print(f"  ✅ processed_messages.json encontrado")
     
+    if not HISTORY_ID_FILE.exists():
+        warnings.append(f"⚠️  {HISTORY_ID_FILE} no existe (primera sincronización por fecha)")
+    else:
+        print(f"  ✅ last_history_id.txt encontrado")
+    
     # Credenciales (solo advertencias en modo local)
-    if not IS_CI:
+    if not IS_CI and not IS_GMAIL_FAKE:
         if not TOKEN_FILE.exists():
             errores.append(f"❌ Faltante: {TOKEN_FILE}")
         else:
@@ -350,6 +367,9 @@ def mostrar_resumen():
         except:
             pass
     
+    if HISTORY_ID_FILE.exists():
+        print(f"🔖 historyId de Gmail: {HISTORY_ID_FILE.read_text().strip()}")
+    
     # Archivos de salida
     jsonl_files = list(OUTPUT_DIR.glob("*.jsonl"))
     if jsonl_files:
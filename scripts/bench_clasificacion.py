@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Benchmark de clasificar_lineas_factura según el tamaño de la librería.
+
+Compara el autómata (Procesar.clasificar_lineas_factura con motor_reglas)
+con la búsqueda anterior (un `in` por regla sobre el texto de la factura,
+incluida aquí como referencia) para la librería real y para librerías
+sintéticas más grandes: las reglas reales más combinaciones de sus palabras
+con códigos inventados. Antes de medir verifica que ambas clasifiquen igual
+todos los documentos. Informa también cuántas reglas se evalúan por
+documento: todas las de los grupos recorridos antes, solo las candidatas del
+índice invertido del motor ahora. Mide sin el memo de clasificaciones.
+
+  python scripts/bench_clasificacion.py                        # 300 documentos sintéticos
+  python scripts/bench_clasificacion.py --reglas 100 1000 10000
+  python scripts/bench_clasificacion.py --corpus pdf_attachments/
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Procesar import cargar_libreria, clasificar_lineas_factura, normalize_text, parse_pdf
+from motor_reglas import GRUPOS, MEMO_CLASIFICACION, MotorReglas
+from paridad_pdf import corpus_pdfs
+
+
+def clasificar_referencia(lineas, reglas):
+    """Implementación anterior: un `in` por regla, grupo por grupo"""
+    if not lineas:
+        return 'Sin clasificacion', 'Sin clasificacion'
+    texto_completo = ' '.join([normalize_text(linea.get('descripcion', '')).lower() for linea in lineas])
+
+    mejor_match = None
+    mayor_especificidad = 0
+    for regla in reglas['producto_y_tratamiento']:
+        if regla['producto'] in texto_completo and regla['tratamiento'] in texto_completo:
+            if regla['especificidad'] > mayor_especificidad:
+                mejor_match = regla
+                mayor_especificidad = regla['especificidad']
+    if mejor_match:
+        return mejor_match['categoria'], mejor_match['subcategoria']
+    for regla in reglas['solo_tratamiento']:
+        if regla['tratamiento'] in texto_completo:
+            if regla['especificidad'] > mayor_especificidad:
+                mejor_match = regla
+                mayor_especificidad = regla['especificidad']
+    if mejor_match:
+        return mejor_match['categoria'], mejor_match['subcategoria']
+    for regla in reglas['solo_producto']:
+        if regla['producto'] in texto_completo:
+            if regla['especificidad'] > mayor_especificidad:
+                mejor_match = regla
+                mayor_especificidad = regla['especificidad']
+    if mejor_match:
+        return mejor_match['categoria'], mejor_match['subcategoria']
+    return 'Sin clasificacion', 'Sin clasificacion'
+
+
+def reglas_evaluadas_referencia(lineas, reglas):
+    """Reglas que evalúa clasificar_referencia: los grupos se recorren enteros hasta uno con coincidencia"""
+    evaluadas = 0
+    for grupo, _ in GRUPOS:
+        evaluadas += len(reglas[grupo])
+        if clasificar_referencia(lineas, {g: (reglas[g] if g == grupo else []) for g, _ in GRUPOS}) \
+                != ('Sin clasificacion', 'Sin clasificacion'):
+            break
+    return evaluadas
+
+
+def libreria_sintetica(base, n, semilla=7):
+    """Las reglas de `base` más reglas inventadas hasta sumar ~n, con el orden de cargar_libreria"""
+    rng = random.Random(semilla)
+    palabras = sorted({p for grupo, campos in GRUPOS for r in base[grupo] for c in campos for p in r[c].split()})
+    reglas = {grupo: list(base[grupo]) for grupo, _ in GRUPOS}
+    faltan = n - sum(len(reglas[grupo]) for grupo, _ in GRUPOS)
+    for i in range(max(0, faltan)):
+        texto = lambda: ' '.join(rng.sample(palabras, rng.randint(1, 3)) + [f'x{i}{rng.randint(0, 99)}'])
+        grupo = rng.choice(('producto_y_tratamiento', 'solo_producto', 'solo_tratamiento'))
+        regla = {'categoria': f'Sintetica {i % 17}', 'subcategoria': f'Sub {i % 5}'}
+        if grupo != 'solo_tratamiento':
+            regla['producto'] = texto()
+        if grupo != 'solo_producto':
+            regla['tratamiento'] = texto()
+        regla['especificidad'] = len(regla.get('producto', '')) + len(regla.get('tratamiento', ''))
+        reglas[grupo].append(regla)
+    for grupo, _ in GRUPOS:
+        reglas[grupo].sort(key=lambda x: x['especificidad'], reverse=True)
+    return reglas
+
+
+def documentos_libreria(reglas, n, semilla=11):
+    """Documentos armados con textos de la librería (para que haya coincidencias de todos los grupos)"""
+    rng = random.Random(semilla)
+    textos = [r[c] for grupo, campos in GRUPOS for r in reglas[grupo] for c in campos]
+    return [[{'descripcion': f"{rng.randint(1, 9)} {t.upper()} {rng.choice(['TALLADO', 'ARMADO', ''])}"}
+             for t in rng.sample(textos, rng.randint(1, 4))] for _ in range(n)]
+
+
+def medir(funcion, documentos, reglas, repeticiones):
+    """Mejor tiempo total (s) de clasificar todos los documentos"""
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        for lineas in documentos:
+            funcion(lineas, reglas)
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de clasificación por tamaño de librería")
+    parser.add_argument('--corpus', help="Directorio de PDFs, fixtures de gmail_simulado o sintetico:N")
+    parser.add_argument('--n', type=int, default=300, help="Documentos sintéticos si no se indica --corpus")
+    parser.add_argument('--reglas', type=int, nargs='+', default=[0, 1000, 5000, 20000],
+                        help="Tamaños de librería a medir (0 = la librería real)")
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = args.corpus or f'sintetico:{args.n}'
+    MEMO_CLASIFICACION.maximo = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        base = cargar_libreria()
+        documentos = [parse_pdf(data, nombre).lineas for nombre, data in corpus_pdfs(corpus)]
+    documentos += documentos_libreria(base, len(documentos))
+    print(f"📄 {len(documentos)} documentos ({corpus} + textos de la librería)")
+
+    print(f"{'reglas':>8} {'estados':>8} {'compilar':>10} {'in por regla':>14} {'motor':>12} {'':>7} "
+          f"{'evaluadas/doc antes':>20} {'ahora':>7}")
+    for n in args.reglas:
+        reglas = libreria_sintetica(base, n)
+        total = sum(len(reglas[grupo]) for grupo, _ in GRUPOS)
+        t0 = time.perf_counter()
+        reglas['motor'] = MotorReglas(reglas)
+        compilar = time.perf_counter() - t0
+
+        distintos = [d for d in documentos if clasificar_lineas_factura(d, reglas) != clasificar_referencia(d, reglas)]
+        if distintos:
+            print(f"❌ {total} reglas: {len(distintos)} documentos con clasificación distinta; primero: {distintos[0]}")
+            return 1
+
+        motor = reglas['motor']
+        motor.documentos = motor.reglas_evaluadas = 0
+        for d in documentos:
+            clasificar_lineas_factura(d, reglas)
+        evaluadas_ahora = motor.reglas_evaluadas / motor.documentos
+        evaluadas_antes = sum(reglas_evaluadas_referencia(d, reglas) for d in documentos) / len(documentos)
+
+        antes = medir(clasificar_referencia, documentos, reglas, args.repeticiones)
+        ahora = medir(clasificar_lineas_factura, documentos, reglas, args.repeticiones)
+        print(f"{total:>8} {len(motor.automata):>8} {compilar * 1000:>8.0f}ms "
+              f"{antes * 1e6 / len(documentos):>10.1f} µs {ahora * 1e6 / len(documentos):>8.1f} µs "
+              f"{antes / ahora:>6.1f}x {evaluadas_antes:>20.1f} {evaluadas_ahora:>7.1f}")
+    print("✅ Clasificaciones idénticas en todos los tamaños")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
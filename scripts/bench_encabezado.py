@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark de extract_header_regex.
+
+Compara el escáner de una pasada (Procesar.extract_header_regex) con la
+implementación anterior (un re.search sin compilar por patrón, incluida aquí
+como referencia). Antes de medir verifica que ambas den el mismo encabezado
+para todo el corpus.
+
+  python scripts/bench_encabezado.py                    # 300 documentos sintéticos
+  python scripts/bench_encabezado.py --n 1000 --repeticiones 5
+  python scripts/bench_encabezado.py --corpus pdf_attachments/
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Procesar import extract_header_regex, extract_pages_text, parse_number, unir_paginas
+from paridad_pdf import corpus_pdfs
+
+# Textos con casos borde de precedencia y valores derivados
+CASOS_BORDE = [
+    "FACTURA ELECTRONICA\nNº 123\nSUBTOTAL 1.000\nIVA 19% 190\n",
+    "Nro: 77-1\nSub Total: $ 10.500\nDescuento pesos 500\nTOTAL 11.900\n",
+    "N° 5\nSUB-TOTAL\nVALOR NETO 8.306\nI.V.A. (19%) 1.578\nTotal 9.884\n",
+    "SUBTOTAL abc\nSubtotal 2.000\nNETO 1.800\nDESCUENTO $ 200\n",
+    "Factura # 99\nsubtotal: 6.98\nIVA 1,33\ntotal 8,31",
+    "sin encabezado reconocible\n",
+    "NOTA DE CREDITO\nNo 42\nVALOR NETO 5.000\nIVA 950\n",
+    "Nº 8\nſUBTOTAL 3.000\nıva 570\n",
+]
+
+
+def extract_header_referencia(text):
+    """Implementación anterior: un re.search por patrón sobre todo el texto"""
+    header = {}
+
+    nro = re.search(r'(?:Factura|N[oº]|Nro|FACTURA)\s*[:#]?\s*([0-9\-]+)', text, re.IGNORECASE)
+    if nro:
+        header['numero'] = nro.group(1).strip()
+
+    patterns = {
+        'SUBTOTAL': [
+            r'SUB[\s-]?TOTAL\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
+            r'SUBTOTAL\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
+            r'Sub\s*Total\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)'
+        ],
+        'descuento_pesos $': [
+            r'descuento[\s_]*pesos?\s*\$?\s*[:\s]*([0-9.,\s]+?)(?=\n|$)',
+            r'DESCUENTO\s*\$?\s*[:\s]*([0-9.,\s]+?)(?=\n|$)'
+        ],
+        'VALOR NETO': [
+            r'VALOR\s+NETO\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
+            r'Valor\s+Neto\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
+            r'NETO\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)'
+        ],
+        'IVA': [
+            r'I\.?V\.?A\.?\s*(?:\([^)]*\))?\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
+            r'IVA\s*19%?\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)'
+        ],
+        'TOTAL': [
+            r'\bTOTAL\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)',
+            r'Total\s*[:\s]*\$?\s*([0-9.,\s]+?)(?=\n|$)'
+        ]
+    }
+
+    for k, pattern_list in patterns.items():
+        valor_encontrado = None
+        for pattern in pattern_list:
+            m = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
+            if m:
+                valor_encontrado = parse_number(m.group(1).strip())
+                if valor_encontrado is not None:
+                    break
+        header[k] = valor_encontrado
+
+    if (header.get('SUBTOTAL') is not None and
+            header.get('IVA') is not None and
+            header.get('TOTAL') is None):
+        header['TOTAL'] = header['SUBTOTAL'] + header['IVA']
+    if (header.get('SUBTOTAL') is not None and
+            header.get('descuento_pesos $') is not None and
+            header.get('VALOR NETO') is None):
+        header['VALOR NETO'] = header['SUBTOTAL'] - header['descuento_pesos $']
+    if header.get('VALOR NETO') is not None and header.get('SUBTOTAL') is None:
+        header['SUBTOTAL'] = header['VALOR NETO']
+    return header
+
+
+def medir(funcion, textos, repeticiones):
+    """Mejor tiempo total (s) de aplicar `funcion` a todos los textos"""
+    mejor = float('inf')
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeticiones):
+            t0 = time.perf_counter()
+            for texto in textos:
+                funcion(texto)
+            mejor = min(mejor, time.perf_counter() - t0)
+    return mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark de extract_header_regex")
+    parser.add_argument('--corpus', help="Directorio de PDFs, fixtures de gmail_simulado o sintetico:N")
+    parser.add_argument('--n', type=int, default=300, help="Documentos sintéticos si no se indica --corpus")
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = args.corpus or f'sintetico:{args.n}'
+    textos = [unir_paginas(extract_pages_text(data)) for _, data in corpus_pdfs(corpus)] + CASOS_BORDE
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        distintos = [t for t in textos if extract_header_regex(t) != extract_header_referencia(t)]
+    if distintos:
+        print(f"❌ {len(distintos)} textos con encabezado distinto; primero:\n{distintos[0][:500]}")
+        return 1
+
+    antes = medir(extract_header_referencia, textos, args.repeticiones)
+    ahora = medir(extract_header_regex, textos, args.repeticiones)
+    print(f"📄 {len(textos)} textos ({corpus} + {len(CASOS_BORDE)} casos borde), resultados idénticos")
+    print(f"⏱️ re.search por patrón: {antes * 1e6 / len(textos):.1f} µs/documento")
+    print(f"⏱️ escáner de una pasada: {ahora * 1e6 / len(textos):.1f} µs/documento")
+    print(f"🚀 {antes / ahora:.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Cache local en disco de mensajes y adjuntos de Gmail.
+
+- Sobres de mensaje (encabezados + descriptores de adjuntos) en JSON, por id de mensaje.
+- Adjuntos decodificados (bytes del PDF), por id de mensaje + parte del mensaje.
+- Desalojo por tamaño: al superar el máximo se borran primero las entradas
+  usadas hace más tiempo (mtime, que se renueva en cada lectura).
+
+Vive fuera de pdf_attachments/, así que sobrevive a limpiar_temporales y
+re-procesar un rango de fechas solo cuesta lecturas de disco.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+CACHE_DIR = os.getenv('GMAIL_CACHE_DIR', '.cache/gmail_simulado' if os.getenv('GMAIL_FAKE') else '.cache/gmail')
+CACHE_MAX_MB = int(os.getenv('GMAIL_CACHE_MAX_MB', '500'))  # 0 = cache desactivado
+
+
+def _nombre_seguro(valor):
+    return re.sub(r'[^A-Za-z0-9_-]', '_', str(valor))
+
+
+class CacheGmail:
+    """Cache en disco de sobres y adjuntos con desalojo por tamaño (LRU por mtime)"""
+
+    def __init__(self, directorio=CACHE_DIR, max_bytes=CACHE_MAX_MB * 1024 * 1024):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'desalojos': 0}
+        self._lock = threading.Lock()
+        self._entradas = None  # ruta -> [mtime, tamaño], se carga al primer uso
+        self._total = 0
+
+    @property
+    def activo(self):
+        return self.max_bytes > 0
+
+    # ---------- rutas ----------
+
+    def _ruta_sobre(self, msg_id):
+        return os.path.join(self.directorio, 'mensajes', f"{_nombre_seguro(msg_id)}.json")
+
+    def _ruta_adjunto(self, msg_id, clave):
+        # La clave es la parte del mensaje (partId/filename): los attachmentId de Gmail
+        # cambian en cada messages().get y no sirven como llave estable
+        digest = hashlib.sha1(str(clave).encode('utf-8')).hexdigest()
+        return os.path.join(self.directorio, 'adjuntos', _nombre_seguro(msg_id), f"{digest}.bin")
+
+    # ---------- índice de tamaño ----------
+
+    def _indice(self):
+        """Escanea el directorio una sola vez (llamar con el lock tomado)"""
+        if self._entradas is None:
+            self._entradas, self._total = {}, 0
+            for raiz, _, archivos in os.walk(self.directorio):
+                for nombre in archivos:
+                    ruta = os.path.join(raiz, nombre)
+                    try:
+                        st = os.stat(ruta)
+                    except OSError:
+                        continue
+                    self._entradas[ruta] = [st.st_mtime, st.st_size]
+                    self._total += st.st_size
+        return self._entradas
+
+    def _desalojar(self):
+        """Borra las entradas menos usadas hasta quedar bajo el 90% del máximo"""
+        entradas = self._indice()
+        if self._total <= self.max_bytes:
+            return
+        objetivo = self.max_bytes * 0.9
+        for ruta, (_, tamano) in sorted(entradas.items(), key=lambda e: e[1][0]):
+            if self._total <= objetivo:
+                break
+            try:
+                os.remove(ruta)
+                os.rmdir(os.path.dirname(ruta))  # solo si quedó vacío
+            except OSError:
+                pass
+            del entradas[ruta]
+            self._total -= tamano
+            self.stats['desalojos'] += 1
+
+    # ---------- lectura / escritura ----------
+
+    def _leer(self, ruta):
+        if not self.activo:
+            return None
+        try:
+            with open(ruta, 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+        ahora = time.time()
+        with self._lock:
+            self.stats['hits'] += 1
+            entrada = self._indice().get(ruta)
+            if entrada:
+                entrada[0] = ahora
+        try:
+            os.utime(ruta, (ahora, ahora))
+        except OSError:
+            pass
+        return data
+
+    def _escribir(self, ruta, data):
+        if not self.activo:
+            return
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        tmp = f"{ruta}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, ruta)
+        with self._lock:
+            entradas = self._indice()
+            anterior = entradas.get(ruta)
+            if anterior:
+                self._total -= anterior[1]
+            entradas[ruta] = [time.time(), len(data)]
+            self._total += len(data)
+            self._desalojar()
+
+    # ---------- API ----------
+
+    def get_envelope(self, msg_id):
+        data = self._leer(self._ruta_sobre(msg_id))
+        return json.loads(data.decode('utf-8')) if data is not None else None
+
+    def put_envelope(self, msg_id, envelope):
+        self._escribir(self._ruta_sobre(msg_id), json.dumps(envelope, ensure_ascii=False).encode('utf-8'))
+
+    def get_attachment(self, msg_id, clave):
+        return self._leer(self._ruta_adjunto(msg_id, clave))
+
+    def put_attachment(self, msg_id, clave, data):
+        self._escribir(self._ruta_adjunto(msg_id, clave), data)
+
+    def resumen(self):
+        """Línea de resumen para el log de la corrida"""
+        with self._lock:
+            total_mb = self._total / (1024 * 1024) if self._entradas is not None else 0
+        return (f"{self.stats['hits']} hits, {self.stats['misses']} misses, "
+                f"{self.stats['desalojos']} desalojos, {total_mb:.1f} MB en {self.directorio}")
+
+
+CACHE = CacheGmail()
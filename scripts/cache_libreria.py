@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Artefacto compilado de la librería de productos (scripts/libreria.xlsx).
+
+Leer el xlsx requiere pandas + openpyxl y armar las reglas con iterrows en
+cada corrida y en cada recategorización. Aquí se guarda en disco (pickle) el
+resultado de cargar_libreria ya normalizado, ordenado y con su MotorReglas,
+junto con la llave del xlsx de origen:
+
+  - si mtime y tamaño del xlsx coinciden con los guardados, se usa tal cual;
+  - si cambió el mtime pero no el contenido (SHA-256), se usa y se actualiza
+    el mtime guardado;
+  - si cambió el contenido, o VERSION_ARTEFACTO, se recompila desde el xlsx.
+"""
+
+import hashlib
+import os
+import pickle
+
+LIBRERIA_CACHE = os.getenv('LIBRERIA_CACHE', '.cache/libreria.pkl')
+# Subir al cambiar la forma de las reglas o de MotorReglas: los artefactos anteriores se recompilan
+VERSION_ARTEFACTO = 3
+
+
+CLAVES_ARTEFACTO = ('version', 'mtime_ns', 'tamano', 'sha256', 'reglas')
+
+
+def sha256_archivo(ruta):
+    """SHA-256 del contenido de un archivo"""
+    digest = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+
+def _leer(ruta):
+    """El artefacto de `ruta`, o None si falta, está corrupto o es de otra versión"""
+    try:
+        with open(ruta, 'rb') as f:
+            artefacto = pickle.load(f)
+    except Exception:
+        # Unpickling puede fallar con casi cualquier excepción: se recompila
+        return None
+    if not isinstance(artefacto, dict) or any(c not in artefacto for c in CLAVES_ARTEFACTO):
+        return None
+    return artefacto if artefacto['version'] == VERSION_ARTEFACTO else None
+
+
+def _guardar(ruta, artefacto):
+    # Escritura atómica: una corrida cortada no deja un artefacto a medias
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, 'wb') as f:
+        pickle.dump(artefacto, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporal, ruta)
+
+
+def reglas_compiladas(ruta_xlsx, compilar, ruta=LIBRERIA_CACHE):
+    """
+    (reglas, origen): las reglas del artefacto si corresponde a `ruta_xlsx`,
+    o las de `compilar()` (que lee el xlsx), que quedan guardadas.
+    origen es 'artefacto' o 'xlsx'.
+    """
+    st = os.stat(ruta_xlsx)
+    artefacto = _leer(ruta)
+    digest = None
+    if artefacto:
+        if (artefacto['mtime_ns'], artefacto['tamano']) == (st.st_mtime_ns, st.st_size):
+            return artefacto['reglas'], 'artefacto'
+        digest = sha256_archivo(ruta_xlsx)
+        if digest == artefacto['sha256']:
+            artefacto['mtime_ns'], artefacto['tamano'] = st.st_mtime_ns, st.st_size
+            _guardar(ruta, artefacto)
+            return artefacto['reglas'], 'artefacto'
+
+    reglas = compilar()
+    _guardar(ruta, {
+        'version': VERSION_ARTEFACTO,
+        'mtime_ns': st.st_mtime_ns,
+        'tamano': st.st_size,
+        'sha256': digest or sha256_archivo(ruta_xlsx),
+        'reglas': reglas,
+    })
+    return reglas, 'xlsx'
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Cache de resultados de parseo de PDFs, direccionado por contenido.
+
+La llave es el SHA-256 de los bytes del PDF más la versión del parser: un
+mismo PDF re-descargado en un backfill o adjunto en varios correos se parsea
+una sola vez. Subir la versión del parser (Procesar.PARSER_VERSION) deja
+fuera de uso las entradas anteriores sin borrar nada a mano.
+
+Guarda en SQLite el encabezado (extract_header_regex) y las líneas de items
+sin el número de documento, que depende del nombre de archivo cuando el PDF
+no lo trae. Funciona desde los procesos del pool de parseo: cada proceso abre
+su propia conexión.
+
+Un error de SQLite (archivo corrupto, base bloqueada) no afecta al parseo:
+se informa una vez y el cache queda desactivado por el resto de la corrida.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DB = os.getenv('PDF_CACHE_DB', '.cache/parseo_simulado.db' if os.getenv('GMAIL_FAKE') else '.cache/parseo.db')
+CACHE_ACTIVO = os.getenv('PDF_CACHE', '1') == '1'  # 0 = siempre parsear
+
+
+def sha256_pdf(fuente):
+    """SHA-256 de un PDF dado como bytes o como ruta"""
+    if isinstance(fuente, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(fuente).hexdigest()
+    digest = hashlib.sha256()
+    with open(fuente, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+
+class CacheParseo:
+    """Resultados de parseo en SQLite por (sha256, versión del parser)"""
+
+    def __init__(self, ruta=CACHE_DB, activo=CACHE_ACTIVO):
+        self.ruta = ruta
+        self.activo = activo
+        self._local = threading.local()
+
+    def _conexion(self):
+        # Una conexión por hilo y por proceso (los hijos del pool no heredan la del padre)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.ruta) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.ruta, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS parseos (
+                    sha256 TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    header TEXT NOT NULL,
+                    lineas TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    PRIMARY KEY (sha256, version)
+                )
+            """)
+            conn.commit()
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _desactivar(self, error):
+        if self.activo:
+            print(f"⚠️ Cache de parseo {self.ruta} desactivado por el resto de la corrida: {error}")
+        self.activo = False
+
+    def get(self, sha256, version):
+        """(header, lineas) guardados para el PDF y versión, o None (también si el cache falla)"""
+        if not self.activo:
+            return None
+        try:
+            fila = self._conexion().execute(
+                'SELECT header, lineas FROM parseos WHERE sha256 = ? AND version = ?', (sha256, version)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._desactivar(e)
+            return None
+        if fila is None:
+            return None
+        return json.loads(fila[0]), json.loads(fila[1])
+
+    def put(self, sha256, version, header, lineas):
+        if not self.activo:
+            return
+        try:
+            conn = self._conexion()
+            conn.execute(
+                'INSERT OR REPLACE INTO parseos (sha256, version, header, lineas, creado) VALUES (?, ?, ?, ?, ?)',
+                (sha256, version, json.dumps(header, ensure_ascii=False),
+                 json.dumps(lineas, ensure_ascii=False), time.time())
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            self._desactivar(e)
+
+    def resumen(self):
+        """Línea de resumen para el log de la corrida"""
+        if not os.path.exists(self.ruta):
+            return f"vacío ({self.ruta})"
+        try:
+            filas = self._conexion().execute('SELECT COUNT(*) FROM parseos').fetchone()[0]
+        except sqlite3.Error as e:
+            return f"no disponible ({self.ruta}: {e})"
+        return f"{filas} PDFs en {self.ruta} ({os.path.getsize(self.ruta) / (1024 * 1024):.1f} MB)"
+
+
+CACHE_PARSEO = CacheParseo()
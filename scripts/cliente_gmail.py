@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Cliente Gmail: fábrica del servicio y transporte HTTP.
+
+- El documento de discovery se guarda en disco y el servicio se arma con
+  build_from_document, sin volver a leerlo ni descargarlo en cada corrida.
+- Todas las llamadas comparten un TransportePool: una sesión requests con
+  pool de conexiones keep-alive, thread-safe, que renueva el token antes de
+  que venza (y lo persiste en token.json).
+- http_hilo da una conexión propia por hilo cuando el servicio usa el
+  transporte httplib2 por defecto, que no es thread-safe.
+"""
+
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+import httplib2
+import requests
+from google.auth.transport.requests import AuthorizedSession, Request
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+
+DISCOVERY_CACHE_DIR = os.getenv('GMAIL_DISCOVERY_CACHE_DIR', '.cache/discovery')
+DISCOVERY_URL = 'https://gmail.googleapis.com/$discovery/rest?version=v1'
+# Conexiones keep-alive del pool (cubrir hilos de descarga + listado + batch)
+POOL_SIZE = int(os.getenv('GMAIL_POOL_SIZE', '16'))
+# Renovar el token si le queda menos que esto de vida
+MARGEN_REFRESCO = timedelta(minutes=int(os.getenv('GMAIL_MARGEN_REFRESCO_MIN', '5')))
+TIMEOUT = 60
+
+_hilo_local = threading.local()
+
+
+def http_hilo(service):
+    """
+    Conexión autorizada propia del hilo actual, para `request.execute(http=...)`.
+    None = transporte del servicio (hilo principal, transporte thread-safe
+    como TransportePool, o servicio sin credenciales).
+    """
+    http = getattr(service, '_http', None)
+    if threading.current_thread() is threading.main_thread() or getattr(http, 'thread_safe', False):
+        return None
+    if not hasattr(_hilo_local, 'http'):
+        credentials = getattr(http, 'credentials', None)
+        _hilo_local.http = AuthorizedHttp(credentials, http=httplib2.Http()) if credentials else None
+    return _hilo_local.http
+
+
+# ============ TOKEN ============
+
+def token_por_vencer(creds, margen=MARGEN_REFRESCO):
+    """True si el token no es válido o vence dentro de `margen`"""
+    if not creds.valid:
+        return True
+    # google-auth guarda expiry como datetime UTC sin zona
+    ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+    return creds.expiry is not None and creds.expiry - ahora < margen
+
+
+def refrescar_token(creds, token_file=None):
+    """Renueva el access token y, si se indica, lo persiste en token_file"""
+    creds.refresh(Request())
+    if token_file:
+        with open(token_file, 'w') as f:
+            f.write(creds.to_json())
+
+
+# ============ TRANSPORTE ============
+
+class TransportePool:
+    """
+    Adaptador con la interfaz de httplib2.Http (request → (Response, bytes))
+    sobre una AuthorizedSession de requests con pool de conexiones keep-alive.
+    Una sola instancia sirve a todos los hilos.
+    """
+
+    thread_safe = True
+
+    def __init__(self, credentials, pool_size=POOL_SIZE, timeout=TIMEOUT, token_file=None):
+        self.credentials = credentials
+        self.timeout = timeout
+        self.token_file = token_file
+        self._lock = threading.Lock()
+        self._session = AuthorizedSession(credentials)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def _refrescar_si_vence(self):
+        if self.credentials.refresh_token and token_por_vencer(self.credentials):
+            with self._lock:
+                if token_por_vencer(self.credentials):
+                    refrescar_token(self.credentials, self.token_file)
+                    print("🔑 Token de Gmail renovado antes de vencer")
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        self._refrescar_si_vence()
+        resp = self._session.request(method, uri, data=body, headers=headers, timeout=self.timeout)
+        info = {k.lower(): v for k, v in resp.headers.items()}
+        info['status'] = str(resp.status_code)
+        # requests ya descomprimió el cuerpo
+        info.pop('content-encoding', None)
+        return httplib2.Response(info), resp.content
+
+    def close(self):
+        self._session.close()
+
+
+# ============ FÁBRICA ============
+
+def discovery_document(api='gmail', version='v1', directorio=DISCOVERY_CACHE_DIR):
+    """Documento de discovery desde el cache en disco; la primera vez lo obtiene y lo guarda"""
+    ruta = os.path.join(directorio, f'{api}.{version}.json')
+    if os.path.exists(ruta):
+        with open(ruta, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    from googleapiclient.discovery_cache import get_static_doc
+    doc = get_static_doc(api, version)
+    if doc is None:
+        resp = requests.get(DISCOVERY_URL, timeout=TIMEOUT)
+        resp.raise_for_status()
+        doc = resp.text
+    os.makedirs(directorio, exist_ok=True)
+    with open(ruta, 'w', encoding='utf-8') as f:
+        f.write(doc)
+    return doc
+
+
+def crear_servicio_gmail(creds, token_file=None, pool_size=POOL_SIZE):
+    """
+    Servicio Gmail v1 con discovery en cache y transporte con pool compartido.
+    pool_size <= 0 usa el transporte httplib2 por defecto de googleapiclient.
+    """
+    if pool_size <= 0:
+        return build_from_document(discovery_document(), credentials=creds)
+    transporte = TransportePool(creds, pool_size=pool_size, token_file=token_file)
+    return build_from_document(discovery_document(), http=transporte)
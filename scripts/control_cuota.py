@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Control de cuota compartido para las llamadas a la Gmail API.
+
+- Cuenta unidades de cuota por tipo de llamada (token bucket por segundo).
+- Ajusta la concurrencia con AIMD: +1 tras una ventana de éxitos, /2 ante un
+  429 / 403 rateLimitExceeded.
+- Reintenta errores de cuota y errores transitorios (5xx) con backoff
+  exponencial con jitter, en vez de saltarse el mensaje.
+
+Todas las llamadas de Procesar y sincronizacion pasan por CONTROLADOR.
+"""
+
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Unidades de cuota por método (https://developers.google.com/gmail/api/reference/quota)
+UNIDADES_POR_TIPO = {
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.attachments.get': 5,
+    'history.list': 2,
+    'getProfile': 1,
+}
+
+RAZONES_LIMITE = ('rateLimitExceeded', 'userRateLimitExceeded')
+ESTADOS_TRANSITORIOS = (500, 502, 503, 504)
+
+
+def http_status(error):
+    """Código HTTP de un error de googleapiclient (o equivalente simulado)"""
+    resp = getattr(error, 'resp', None)
+    return getattr(resp, 'status', None)
+
+
+def es_error_limite(error):
+    """True si el error es un 429 o un 403 por límite de cuota"""
+    status = http_status(error)
+    if status == 429:
+        return True
+    if status == 403:
+        contenido = getattr(error, 'content', b'') or b''
+        if isinstance(contenido, bytes):
+            contenido = contenido.decode('utf-8', 'replace')
+        return any(razon in contenido for razon in RAZONES_LIMITE)
+    return False
+
+
+def es_reintentable(error):
+    """Errores que vale la pena reintentar: cuota o fallas transitorias del servidor"""
+    return es_error_limite(error) or http_status(error) in ESTADOS_TRANSITORIOS
+
+
+class ControladorCuota:
+    """Limitador adaptativo (AIMD) con contabilidad de cuota y reintentos con jitter"""
+
+    def __init__(self, unidades_por_segundo=250, concurrencia_inicial=4, concurrencia_max=16,
+                 max_reintentos=6, backoff_base=1.0, backoff_max=64.0):
+        self.unidades_por_segundo = unidades_por_segundo
+        self.concurrencia_max = max(concurrencia_max, 1)
+        self.max_reintentos = max_reintentos
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._cond = threading.Condition()
+        self._limite = min(max(concurrencia_inicial, 1), self.concurrencia_max)
+        self._en_vuelo = 0
+        self._exitos = 0
+
+        self._lock_cuota = threading.Lock()
+        self._unidades = float(unidades_por_segundo)
+        self._ultimo_relleno = time.monotonic()
+
+        self.stats = {'llamadas': {}, 'unidades': 0, 'reintentos': 0, 'limites': 0}
+
+    @property
+    def concurrencia(self):
+        return self._limite
+
+    # ---------- concurrencia (AIMD) ----------
+
+    @contextmanager
+    def _slot(self):
+        with self._cond:
+            while self._en_vuelo >= self._limite:
+                self._cond.wait()
+            self._en_vuelo += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._en_vuelo -= 1
+                self._cond.notify_all()
+
+    def registrar_exito(self):
+        """Aumento aditivo: +1 de concurrencia tras `limite` éxitos seguidos"""
+        with self._cond:
+            self._exitos += 1
+            if self._exitos >= self._limite and self._limite < self.concurrencia_max:
+                self._limite += 1
+                self._exitos = 0
+                self._cond.notify_all()
+
+    def registrar_limite(self):
+        """Disminución multiplicativa: concurrencia a la mitad ante un error de cuota"""
+        with self._cond:
+            self._limite = max(1, self._limite // 2)
+            self._exitos = 0
+            self.stats['limites'] += 1
+
+    # ---------- cuota (token bucket) ----------
+
+    def _tomar_unidades(self, unidades):
+        """Espera hasta tener saldo; una llamada grande (batch) puede dejar el saldo negativo"""
+        while True:
+            with self._lock_cuota:
+                ahora = time.monotonic()
+                self._unidades = min(
+                    self.unidades_por_segundo,
+                    self._unidades + (ahora - self._ultimo_relleno) * self.unidades_por_segundo,
+                )
+                self._ultimo_relleno = ahora
+                if self._unidades >= min(unidades, self.unidades_por_segundo):
+                    self._unidades -= unidades
+                    self.stats['unidades'] += unidades
+                    return
+                espera = (min(unidades, self.unidades_por_segundo) - self._unidades) / self.unidades_por_segundo
+            time.sleep(espera)
+
+    # ---------- ejecución ----------
+
+    def backoff(self, intento):
+        """Espera con jitter completo: uniforme en [0, min(max, base * 2^intento)]"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** intento)))
+
+    def ejecutar(self, tipo, llamada, unidades=None):
+        """
+        Ejecuta `llamada()` respetando concurrencia y cuota de `tipo`.
+        Reintenta errores de cuota/transitorios; otros errores se propagan de inmediato.
+        """
+        if unidades is None:
+            unidades = UNIDADES_POR_TIPO.get(tipo, 5)
+        for intento in range(self.max_reintentos + 1):
+            with self._slot():
+                self._tomar_unidades(unidades)
+                with self._cond:
+                    self.stats['llamadas'][tipo] = self.stats['llamadas'].get(tipo, 0) + 1
+                try:
+                    resultado = llamada()
+                except Exception as e:
+                    error = e
+                else:
+                    self.registrar_exito()
+                    return resultado
+
+            if not es_reintentable(error) or intento == self.max_reintentos:
+                raise error
+            if es_error_limite(error):
+                self.registrar_limite()
+            with self._cond:
+                self.stats['reintentos'] += 1
+            time.sleep(self.backoff(intento))
+
+    def resumen(self):
+        """Línea de resumen para el log de la corrida"""
+        llamadas = sum(self.stats['llamadas'].values())
+        return (f"{llamadas} llamadas, {self.stats['unidades']} unidades de cuota, "
+                f"{self.stats['reintentos']} reintentos, {self.stats['limites']} límites de cuota, "
+                f"concurrencia final {self._limite}")
+
+
+# Hilos que hacen llamadas (descarga de adjuntos y listado): un límite mayor no tendría efecto
+HILOS_GMAIL = max(int(os.getenv('GMAIL_DOWNLOAD_WORKERS', '4')), int(os.getenv('GMAIL_LIST_WORKERS', '4')))
+
+CONTROLADOR = ControladorCuota(
+    unidades_por_segundo=int(os.getenv('GMAIL_QUOTA_UNITS', '250')),
+    concurrencia_inicial=int(os.getenv('GMAIL_DOWNLOAD_WORKERS', '4')),
+    concurrencia_max=min(int(os.getenv('GMAIL_CONCURRENCIA_MAX', str(HILOS_GMAIL))), HILOS_GMAIL),
+    max_reintentos=int(os.getenv('GMAIL_MAX_REINTENTOS', '6')),
+)
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+Servicio Gmail simulado para correr el pipeline sin red (benchmarks de ingesta).
+
+Implementa la superficie que usa Procesar:
+  users().messages().list/get, users().messages().attachments().get,
+  users().history().list, users().getProfile y new_batch_http_request.
+
+Fuentes de mensajes (variable de entorno GMAIL_FAKE):
+  GMAIL_FAKE=sintetico          → 200 facturas/notas sintéticas
+  GMAIL_FAKE=sintetico:5000     → N mensajes sintéticos
+  GMAIL_FAKE=ruta/fixtures      → mensajes grabados (mensajes.jsonl) con `grabar`
+
+GMAIL_FAKE_LATENCIA_MS simula la latencia de cada ida y vuelta HTTP (un batch
+cuenta como una sola), para que batch e hilos se midan de forma realista.
+
+Uso por consola:
+  python scripts/gmail_simulado.py grabar fixtures/           # desde el Gmail real
+  python scripts/gmail_simulado.py sintetico fixtures/ --n 1000
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from email.utils import format_datetime, parsedate_to_datetime
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+FIXTURES_FILE = 'mensajes.jsonl'
+REMITENTE = 'facturacion@rodenstock.cl'
+
+
+def _http_error(status, mensaje):
+    contenido = json.dumps({'error': {'code': status, 'message': mensaje}}).encode('utf-8')
+    return HttpError(httplib2.Response({'status': status}), contenido)
+
+
+# ============ PDF SINTÉTICO ============
+
+def _escapar_pdf(texto):
+    return texto.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def construir_pdf(paginas):
+    """
+    Arma un PDF mínimo (Helvetica, texto plano) con una lista de páginas,
+    cada una una lista de renglones. Suficiente para pdfplumber y pypdfium2.
+    """
+    n = len(paginas)
+    objetos = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [' + b' '.join(b'%d 0 R' % (4 + 2 * i) for i in range(n)) + b'] /Count %d >>' % n,
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+    ]
+    for i, renglones in enumerate(paginas):
+        contenido = ['BT', '/F1 9 Tf', '12 TL', '40 800 Td']
+        contenido += [f'({_escapar_pdf(r)}) Tj T*' for r in renglones]
+        contenido.append('ET')
+        stream = '\n'.join(contenido).encode('cp1252')
+        objetos.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                       b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % (5 + 2 * i))
+        objetos.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+
+    salida = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for i, obj in enumerate(objetos, 1):
+        offsets.append(len(salida))
+        salida += b'%d 0 obj\n' % i + obj + b'\nendobj\n'
+    inicio_xref = len(salida)
+    salida += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objetos) + 1)
+    for off in offsets:
+        salida += b'%010d 00000 n \n' % off
+    salida += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objetos) + 1, inicio_xref)
+    return bytes(salida)
+
+
+_PRODUCTOS = [
+    ('PPL160', 'Progressiv Pro L 1.60', 25700),
+    ('PPM167', 'Progressiv Pro M 1.67', 31200),
+    ('SV167AS', 'SV ORGANIC 1.67 AS', 16500),
+    ('SV150', 'SV ORGANIC 1.50', 9800),
+]
+_TRATAMIENTOS = [
+    ('HSARD', 'hard Super-AR double+', 5500),
+    ('HSARB', 'HSAR++ BLUE', 7900),
+]
+
+
+def _miles(valor):
+    return f"{valor:,}".replace(',', '.')
+
+
+def texto_documento_sintetico(numero, fecha, rng, is_nota=False, renglones_relleno=0):
+    """Renglones de una factura / nota de crédito con el formato de Rodenstock"""
+    codigo, producto, precio_p = rng.choice(_PRODUCTOS)
+    codigo_t, tratamiento, precio_t = rng.choice(_TRATAMIENTOS)
+    items = []
+    for _ in range(2):
+        graduacion = f"+{rng.randint(0, 4)}.{rng.choice(['00', '25', '50', '75'])} +0.00 +0.00"
+        items.append((codigo, f"{producto} {graduacion}", precio_p))
+        items.append((codigo_t, tratamiento, precio_t))
+
+    renglones = [
+        'RODENSTOCK CHILE S.A.',
+        'NOTA DE CREDITO ELECTRONICA' if is_nota else 'FACTURA ELECTRONICA',
+        f'Nº {numero}',
+        f'Fecha Emision: {fecha.strftime("%d/%m/%Y")}',
+        'Item Codigo Descripcion Cantidad Precio Desc Valor',
+    ]
+    subtotal = 0
+    for n_linea, (cod, desc, precio) in enumerate(items, 1):
+        subtotal += precio
+        renglones.append(f'{n_linea} {cod} {desc} 1 {_miles(precio)} 0,00 {_miles(precio)}')
+    renglones += [f'Observacion {i + 1}: texto de relleno' for i in range(renglones_relleno)]
+    iva = round(subtotal * 0.19)
+    renglones += [
+        f'SUBTOTAL {_miles(subtotal)}',
+        f'IVA 19% {_miles(iva)}',
+        f'TOTAL {_miles(subtotal + iva)}',
+    ]
+    return renglones
+
+
+def generar_sinteticos(n, semilla=42, hasta=None):
+    """Genera n registros {message, attachments} con un PDF cada uno (~10% notas de crédito)"""
+    rng = random.Random(semilla)
+    hasta = hasta or datetime(2026, 8, 21, 12, 0)
+    registros = []
+    for i in range(n):
+        fecha = hasta - timedelta(hours=(n - i) * 6)
+        is_nota = rng.random() < 0.1
+        numero = f"{(1168000 if is_nota else 3068000) + i:010d}"
+        # ~5% de documentos largos (observaciones de relleno) para tener PDFs de varias páginas
+        relleno = 150 if rng.random() < 0.05 else 0
+        renglones = texto_documento_sintetico(numero, fecha, rng, is_nota=is_nota, renglones_relleno=relleno)
+        paginas = [renglones[j:j + 60] for j in range(0, len(renglones), 60)]
+        pdf = construir_pdf(paginas)
+        nombre = f"{'NotaCredito' if is_nota else 'Factura'}_{numero}.pdf"
+        msg_id = f"{0x19c0000000000000 + i * 7919:x}"
+        att_id = f"ATT{msg_id}"
+        registros.append({
+            'message': {
+                'id': msg_id,
+                'threadId': msg_id,
+                'labelIds': ['INBOX'],
+                'internalDate': str(int(fecha.timestamp() * 1000)),
+                'payload': {
+                    'partId': '',
+                    'headers': [
+                        {'name': 'From', 'value': f'Rodenstock <{REMITENTE}>'},
+                        {'name': 'Subject', 'value': nombre},
+                        {'name': 'Date', 'value': format_datetime(fecha.astimezone())},
+                    ],
+                    'filename': '',
+                    'body': {'size': 0},
+                    'parts': [
+                        {'partId': '0', 'filename': '', 'body': {'size': 64}},
+                        {'partId': '1', 'filename': nombre,
+                         'body': {'attachmentId': att_id, 'size': len(pdf)}},
+                    ],
+                },
+            },
+            'attachments': {att_id: base64.urlsafe_b64encode(pdf).decode('ascii')},
+        })
+    return registros
+
+
+# ============ SERVICIO SIMULADO ============
+
+class _Request:
+    """Equivalente a googleapiclient.http.HttpRequest: execute() hace la 'llamada'"""
+
+    def __init__(self, servicio, funcion):
+        self._servicio = servicio
+        self._funcion = funcion
+
+    def execute(self, http=None, num_retries=0):
+        self._servicio._ida_y_vuelta()
+        return self._funcion()
+
+
+class _Batch:
+    """Equivalente a BatchHttpRequest: una sola ida y vuelta para todos los ítems"""
+
+    def __init__(self, servicio, callback):
+        self._servicio = servicio
+        self._callback = callback
+        self._items = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._items.append((request_id or str(len(self._items) + 1), request, callback or self._callback))
+
+    def execute(self, http=None):
+        self._servicio._ida_y_vuelta()
+        for request_id, request, callback in self._items:
+            try:
+                respuesta, error = request._funcion(), None
+            except HttpError as e:
+                respuesta, error = None, e
+            callback(request_id, respuesta, error)
+
+
+class _Recurso:
+    """Nodo encadenable users()/messages()/attachments()/history()"""
+
+    def __init__(self, servicio):
+        self._servicio = servicio
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return _Mensajes(self._servicio)
+
+    def history(self):
+        return _Historial(self._servicio)
+
+    def getProfile(self, userId='me'):
+        s = self._servicio
+        return _Request(s, lambda: {'emailAddress': 'simulado@local', 'messagesTotal': len(s.mensajes),
+                                    'historyId': str(s.history_id_actual)})
+
+
+class _Mensajes:
+    def __init__(self, servicio):
+        self._servicio = servicio
+
+    def list(self, userId='me', q=None, pageToken=None, maxResults=100, **_):
+        return _Request(self._servicio, lambda: self._servicio._listar(q, pageToken, maxResults))
+
+    def get(self, userId='me', id=None, format='full', fields=None, **_):
+        s = self._servicio
+
+        def _get():
+            if id not in s.mensajes:
+                raise _http_error(404, f'Requested entity was not found: {id}')
+            return s.mensajes[id]['message']
+        return _Request(s, _get)
+
+    def attachments(self):
+        return _Adjuntos(self._servicio)
+
+
+class _Adjuntos:
+    def __init__(self, servicio):
+        self._servicio = servicio
+
+    def get(self, userId='me', messageId=None, id=None, **_):
+        s = self._servicio
+
+        def _get():
+            data = s.mensajes.get(messageId, {}).get('attachments', {}).get(id)
+            if data is None:
+                raise _http_error(404, f'Invalid attachment id: {id}')
+            return {'attachmentId': id, 'size': len(data) * 3 // 4, 'data': data}
+        return _Request(s, _get)
+
+
+class _Historial:
+    def __init__(self, servicio):
+        self._servicio = servicio
+
+    def list(self, userId='me', startHistoryId=None, historyTypes=None, labelId=None,
+             pageToken=None, maxResults=100, **_):
+        return _Request(self._servicio, lambda: self._servicio._historial(
+            startHistoryId, labelId, pageToken, maxResults))
+
+
+class ServicioGmailSimulado(_Recurso):
+    """
+    Buzón en memoria. Cada mensaje recibe un historyId creciente en orden
+    de llegada; startHistoryId menor que `history_id_minimo` responde 404
+    (historial expirado), como la API real.
+    """
+
+    def __init__(self, registros, latencia=0.0, history_id_minimo=0):
+        super().__init__(self)
+        self.latencia = latencia
+        self.llamadas = 0
+        ordenados = sorted(registros, key=lambda r: int(r['message'].get('internalDate', 0)))
+        self.mensajes = {}
+        self._history = []
+        for i, registro in enumerate(ordenados, 1):
+            msg_id = registro['message']['id']
+            self.mensajes[msg_id] = registro
+            self._history.append((1000 + i, registro['message']))
+        self.history_id_actual = 1000 + len(ordenados)
+        self.history_id_minimo = history_id_minimo
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+    def _ida_y_vuelta(self):
+        self.llamadas += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    def _listar(self, q, page_token, max_results):
+        desde, antes, remitente = None, None, None
+        for termino in (q or '').split():
+            if termino.startswith('after:'):
+                desde = datetime.strptime(termino[6:], '%Y/%m/%d')
+            elif termino.startswith('before:'):
+                antes = datetime.strptime(termino[7:], '%Y/%m/%d')
+            elif termino.startswith('from:'):
+                remitente = termino[5:].lower()
+
+        seleccion = []
+        for _, message in reversed(self._history):  # Gmail lista del más nuevo al más antiguo
+            headers = {h['name']: h['value'] for h in message.get('payload', {}).get('headers', [])}
+            fecha = parsedate_to_datetime(headers['Date']).replace(tzinfo=None) if 'Date' in headers else None
+            if desde and fecha and fecha < desde:
+                continue
+            if antes and fecha and fecha >= antes:
+                continue
+            if remitente and remitente not in headers.get('From', '').lower():
+                continue
+            seleccion.append({'id': message['id'], 'threadId': message.get('threadId')})
+
+        inicio = int(page_token or 0)
+        pagina = seleccion[inicio:inicio + max_results]
+        resp = {'resultSizeEstimate': len(seleccion)}
+        if pagina:
+            resp['messages'] = pagina
+        if inicio + max_results < len(seleccion):
+            resp['nextPageToken'] = str(inicio + max_results)
+        return resp
+
+    def _historial(self, start_history_id, label_id, page_token, max_results):
+        start = int(start_history_id)
+        if start < self.history_id_minimo:
+            raise _http_error(404, f'Requested entity was not found: historyId {start}')
+        registros = [
+            {'id': str(h), 'messages': [{'id': m['id']}],
+             'messagesAdded': [{'message': {'id': m['id'], 'threadId': m.get('threadId'),
+                                            'labelIds': m.get('labelIds', [])}}]}
+            for h, m in self._history
+            if h > start and (not label_id or label_id in m.get('labelIds', []))
+        ]
+        inicio = int(page_token or 0)
+        resp = {'history': registros[inicio:inicio + max_results], 'historyId': str(self.history_id_actual)}
+        if inicio + max_results < len(registros):
+            resp['nextPageToken'] = str(inicio + max_results)
+        return resp
+
+
+# ============ FIXTURES ============
+
+def cargar_fixtures(ruta):
+    """Lee registros grabados desde un directorio (mensajes.jsonl) o un .jsonl"""
+    if os.path.isdir(ruta):
+        ruta = os.path.join(ruta, FIXTURES_FILE)
+    with open(ruta, 'r', encoding='utf-8') as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+def guardar_fixtures(registros, destino):
+    os.makedirs(destino, exist_ok=True)
+    ruta = os.path.join(destino, FIXTURES_FILE)
+    with open(ruta, 'w', encoding='utf-8') as f:
+        for registro in registros:
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    print(f"✅ {len(registros)} mensajes guardados en {ruta}")
+
+
+def grabar(service, query, destino):
+    """Graba mensajes reales (format='full' + adjuntos) para reproducirlos sin red"""
+    from sincronizacion import get_all_messages
+
+    registros = []
+    for m in get_all_messages(service, query):
+        message = service.users().messages().get(userId='me', id=m['id'], format='full').execute()
+        attachments = {}
+        for part in message.get('payload', {}).get('parts', []) or [message.get('payload', {})]:
+            att_id = part.get('body', {}).get('attachmentId')
+            if att_id:
+                data = service.users().messages().attachments().get(
+                    userId='me', messageId=m['id'], id=att_id).execute().get('data')
+                attachments[att_id] = data
+        registros.append({'message': message, 'attachments': attachments})
+        print(f"📼 Grabado {m['id']} ({len(attachments)} adjuntos)")
+    guardar_fixtures(registros, destino)
+
+
+def crear_servicio(fuente, latencia_ms=None):
+    """Crea el servicio simulado a partir del valor de GMAIL_FAKE"""
+    if latencia_ms is None:
+        latencia_ms = float(os.getenv('GMAIL_FAKE_LATENCIA_MS', '0'))
+    if fuente.startswith('sintetico'):
+        _, _, n = fuente.partition(':')
+        registros = generar_sinteticos(int(n or 200))
+    else:
+        registros = cargar_fixtures(fuente)
+    print(f"🧪 Gmail simulado: {len(registros)} mensajes ({fuente}), latencia {latencia_ms:.0f} ms")
+    return ServicioGmailSimulado(registros, latencia=latencia_ms / 1000)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fixtures para el Gmail simulado")
+    sub = parser.add_subparsers(dest='comando', required=True)
+    p_grabar = sub.add_parser('grabar', help="Grabar mensajes del Gmail real")
+    p_grabar.add_argument('destino')
+    p_grabar.add_argument('--query', default='from:facturacion@rodenstock.cl in:inbox')
+    p_sint = sub.add_parser('sintetico', help="Generar mensajes sintéticos")
+    p_sint.add_argument('destino')
+    p_sint.add_argument('--n', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.comando == 'grabar':
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from Procesar import authenticate_gmail
+        grabar(authenticate_gmail(), args.query, args.destino)
+    else:
+        guardar_fixtures(generar_sinteticos(args.n), args.destino)
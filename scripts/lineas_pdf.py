@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Parser de líneas de items de facturas y notas de crédito Rodenstock.
+
+- El patrón de línea se compila una sola vez al importar el módulo.
+- Prefiltro barato: solo se intenta el patrón en renglones que empiezan con
+  un número de línea (tras espacios); el resto del texto no pasa por el motor
+  de regex.
+- API por lotes: parse_lineas recibe el texto de todas las páginas de un
+  documento y entrega los mismos dicts que espera Cargar.
+
+Los resultados son idénticos a aplicar `LINEA_RE.finditer` sobre cada página.
+"""
+
+import re
+
+# Una línea de item: N° línea, código, descripción, cantidad, precio, descuento, total
+LINEA_RE = re.compile(
+    r'^\s*(\d{1,3})\s+'
+    r'([A-Za-z0-9\-\.\/_]+?)\s+'
+    r'(.+?)\s+'
+    r'(\d+(?:[.,]\d+)?)\s+'
+    r'([\d.,]+)\s+'
+    r'([\d.,]+%?)?'
+    r'\s+([\d.,]+)\s*$',
+    re.MULTILINE
+)
+_PREFIJO_NUMERICO_RE = re.compile(r'^\d+\s+')
+_NO_NUMERICO_RE = re.compile(r'[^\d\.\-]')
+
+
+def limpiar_prefijo_numerico(texto):
+    """
+    Elimina prefijos numéricos al inicio del texto.
+    Ejemplos: "65 Progressiv Pro L" -> "Progressiv Pro L"
+    """
+    if not texto:
+        return texto
+    texto = str(texto).strip()
+    texto_limpio = _PREFIJO_NUMERICO_RE.sub('', texto)
+    return texto_limpio.strip()
+
+
+def parse_number(s):
+    """
+    Convierte string a número manejando formatos chilenos y decimales.
+    
+    Casos:
+    - "8.306" con punto → Si tiene 3 dígitos después del punto = miles → 8306
+    - "6.98" con punto → Si tiene 1-2 dígitos después del punto = decimal → 6.98
+    - "6,98" → coma es decimal → 6.98
+    - "1.234,56" → punto miles, coma decimal → 1234.56
+    """
+    if s is None:
+        return None
+    if isinstance(s, (int, float)):
+        return s
+    
+    s = str(s).strip()
+    if s == '' or s == '-':
+        return None
+    
+    # Camino rápido: solo dígitos (cantidades, números de línea)
+    if s.isdecimal():
+        return int(s)
+
+    # Eliminar espacios
+    s = s.replace(' ', '')
+    
+    # Detectar si tiene tanto punto como coma
+    tiene_punto = '.' in s
+    tiene_coma = ',' in s
+    
+    if tiene_punto and tiene_coma:
+        # Formato: 1.234,56 → punto es miles, coma es decimal
+        s = s.replace('.', '').replace(',', '.')
+    elif tiene_coma and not tiene_punto:
+        # Formato: 1234,56 → coma es decimal
+        s = s.replace(',', '.')
+    elif tiene_punto and not tiene_coma:
+        # Ambiguo: puede ser miles o decimal
+        # Detectar basándose en la posición del punto
+        partes = s.split('.')
+        if len(partes) == 2:
+            parte_entera = partes[0]
+            parte_decimal = partes[1]
+            
+            # Si la parte decimal tiene exactamente 3 dígitos, probablemente es separador de miles
+            # Ejemplo: "8.306" → 8306
+            if len(parte_decimal) == 3 and parte_entera.isdigit() and parte_decimal.isdigit():
+                s = parte_entera + parte_decimal
+            # Si la parte decimal tiene 1 o 2 dígitos, es decimal
+            # Ejemplo: "6.98" → 6.98
+            elif len(parte_decimal) <= 2:
+                # Dejar el punto como está (ya es formato decimal correcto)
+                pass
+            else:
+                # Caso extraño, eliminar puntos
+                s = s.replace('.', '')
+    
+    # Limpiar caracteres no numéricos excepto punto y signo negativo
+    s = _NO_NUMERICO_RE.sub('', s)
+    
+    try:
+        if s == '' or s == '-':
+            return None
+        val = float(s) if '.' in s else int(s)
+        return val
+    except:
+        return None
+
+
+def iter_matches(text):
+    r"""
+    Matches de LINEA_RE en el texto de una página, en el mismo orden que finditer.
+
+    Un match solo puede empezar al inicio de un renglón, y `^\s*` salta los
+    espacios y renglones en blanco hasta un dígito: basta probar los renglones
+    cuyo primer carácter no blanco es un dígito, desde el fin del match anterior.
+    """
+    inicio = 0
+    fin_anterior = 0
+    for renglon in text.split('\n'):
+        if inicio >= fin_anterior and renglon.lstrip()[:1].isdecimal():
+            m = LINEA_RE.match(text, inicio)
+            if m:
+                fin_anterior = m.end()
+                yield m
+        inicio += len(renglon) + 1
+
+
+def linea_desde_match(match, numero_factura, is_nota=False):
+    """Dict de una línea de item a partir de un match de LINEA_RE"""
+    desc = limpiar_prefijo_numerico(match.group(3).strip())
+    cantidad_raw = parse_number(match.group(4))
+    cantidad = int(cantidad_raw) if cantidad_raw and float(cantidad_raw).is_integer() else cantidad_raw
+
+    return {
+        ('numerofactura' if not is_nota else 'numeronota'): str(numero_factura),
+        'linea_numero': int(match.group(1)),
+        'descripcion': desc,
+        'cantidad': cantidad,
+        'precio_unitario': parse_number(match.group(5)),
+        'descuento_pesos_porcentaje': parse_number(match.group(6)),
+        'total_linea': parse_number(match.group(7)),
+    }
+
+
+def parse_lineas(paginas, numero_factura, is_nota=False):
+    """Líneas de items de todas las páginas (lista de textos) de un documento"""
+    return [linea_desde_match(m, numero_factura, is_nota)
+            for text in paginas
+            for m in iter_matches(text)]
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Motor de clasificación por librería con un autómata Aho-Corasick.
+
+clasificar_lineas_factura buscaba cada producto y tratamiento de la librería
+con `in` sobre el texto de la factura: O(reglas × texto) por documento. Aquí
+los textos de todas las reglas se compilan una vez en un autómata que, en una
+sola pasada por el texto, dice cuáles aparecen; después solo se revisan las
+reglas indexadas por alguno de ellos. Con librerías chicas los textos
+distintos se buscan uno a uno (MIN_TEXTOS_AUTOMATA).
+
+Misma semántica que la búsqueda con `in`:
+  - prioridad producto_y_tratamiento → solo_tratamiento → solo_producto;
+  - dentro de un grupo gana la primera regla de la lista (ordenada por
+    especificidad descendente) que coincide, y solo con especificidad > 0;
+  - un campo vacío coincide siempre (`'' in texto`).
+
+MEMO_CLASIFICACION guarda las últimas clasificaciones por texto de factura:
+las facturas suelen repetir las mismas descripciones.
+"""
+
+import hashlib
+import json
+import os
+from collections import Counter, OrderedDict, deque
+
+# Grupos de reglas en orden de prioridad y los campos que deben aparecer
+GRUPOS = (
+    ('producto_y_tratamiento', ('producto', 'tratamiento')),
+    ('solo_tratamiento', ('tratamiento',)),
+    ('solo_producto', ('producto',)),
+)
+SIN_CLASIFICACION = ('Sin clasificacion', 'Sin clasificacion')
+# Con pocos textos distintos, un `in` por texto (en C) le gana a recorrer el
+# autómata en Python (ver bench_clasificacion.py: el cruce ronda los 100)
+MIN_TEXTOS_AUTOMATA = 100
+# Entradas del memo de clasificaciones (LRU). 0 = sin memo
+MEMO_MAXIMO = int(os.getenv('CLASIFICACION_MEMO', '4096'))
+
+
+class AhoCorasick:
+    """Autómata para buscar muchos textos (no vacíos) a la vez en una pasada"""
+
+    def __init__(self, patrones):
+        self.patrones = list(patrones)
+        goto, fallo, salida = [{}], [0], [()]
+        for i, patron in enumerate(self.patrones):
+            estado = 0
+            for c in patron:
+                sig = goto[estado].get(c)
+                if sig is None:
+                    sig = len(goto)
+                    goto[estado][c] = sig
+                    goto.append({})
+                    fallo.append(0)
+                    salida.append(())
+                estado = sig
+            salida[estado] += (i,)
+
+        # Enlaces de fallo por niveles; cada estado hereda las salidas de su enlace
+        cola = deque(goto[0].values())
+        while cola:
+            estado = cola.popleft()
+            for c, sig in goto[estado].items():
+                cola.append(sig)
+                f = fallo[estado]
+                while f and c not in goto[f]:
+                    f = fallo[f]
+                fallo[sig] = goto[f].get(c, 0)
+                salida[sig] += salida[fallo[sig]]
+
+        self._goto, self._fallo, self._salida = goto, fallo, salida
+
+    def __len__(self):
+        return len(self._goto)
+
+    def buscar(self, texto):
+        """Índices (en `patrones`) de los textos que aparecen en `texto`"""
+        goto, fallo, salida = self._goto, self._fallo, self._salida
+        encontrados = set()
+        estado = 0
+        for c in texto:
+            sig = goto[estado].get(c)
+            while sig is None and estado:
+                estado = fallo[estado]
+                sig = goto[estado].get(c)
+            estado = sig or 0
+            if salida[estado]:
+                encontrados.update(salida[estado])
+        return encontrados
+
+
+class MotorReglas:
+    """Reglas de cargar_libreria compiladas: clasificar(texto) → (categoria, subcategoria)"""
+
+    def __init__(self, reglas):
+        self._reglas = [reglas[grupo] for grupo, _ in GRUPOS]
+        # Huella del contenido de las reglas: separa en el memo las de librerías distintas
+        self.version = hashlib.sha256(json.dumps(self._reglas, sort_keys=True, ensure_ascii=False,
+                                                 default=str).encode()).hexdigest()[:16]
+        indice_texto = {}
+        requeridas = []
+        for g, (grupo, campos) in enumerate(GRUPOS):
+            for pos, regla in enumerate(reglas[grupo]):
+                if regla['especificidad'] <= 0:
+                    continue  # nunca supera a "sin coincidencia"
+                ids = [indice_texto.setdefault(regla[c], len(indice_texto)) for c in campos if regla[c]]
+                requeridas.append((g, pos, ids))
+
+        # Índice invertido texto → reglas: cada regla queda bajo el más raro de
+        # sus textos (el de menos reglas) y solo se evalúa si ese texto aparece
+        reglas_por_texto = Counter(i for _, _, ids in requeridas for i in set(ids))
+        self.indice = {}
+        for g, pos, ids in requeridas:
+            self.indice.setdefault(min(ids, key=reglas_por_texto.__getitem__), []).append((g, pos, frozenset(ids)))
+
+        self.automata = AhoCorasick(indice_texto)
+        if len(indice_texto) < MIN_TEXTOS_AUTOMATA:
+            self.buscar = self._buscar_directo
+        else:
+            self.buscar = self.automata.buscar
+        # Reglas candidatas evaluadas (ver bench_clasificacion.py)
+        self.documentos = 0
+        self.reglas_evaluadas = 0
+
+    def _buscar_directo(self, texto):
+        return {i for i, patron in enumerate(self.automata.patrones) if patron in texto}
+
+    def clasificar(self, texto):
+        """Categoría de la regla ganadora para un texto ya normalizado en minúsculas"""
+        encontrados = self.buscar(texto)
+        mejores = [None] * len(GRUPOS)
+        self.documentos += 1
+        for i in encontrados:
+            candidatas = self.indice.get(i, ())
+            self.reglas_evaluadas += len(candidatas)
+            for g, pos, ids in candidatas:
+                if (mejores[g] is None or pos < mejores[g]) and ids <= encontrados:
+                    mejores[g] = pos
+        for g, pos in enumerate(mejores):
+            if pos is not None:
+                regla = self._reglas[g][pos]
+                return regla['categoria'], regla['subcategoria']
+        return SIN_CLASIFICACION
+
+
+def _firmas(reglas, campos):
+    """(regla serializada, n° de repetición) de cada regla, en orden"""
+    vistas, firmas = {}, []
+    for regla in reglas:
+        firma = json.dumps([regla.get(c) for c in (*campos, 'categoria', 'subcategoria', 'especificidad')],
+                           ensure_ascii=False, default=str)
+        vistas[firma] = vistas.get(firma, -1) + 1
+        firmas.append((firma, vistas[firma]))
+    return firmas
+
+
+def textos_cambiados(anteriores, nuevas):
+    """
+    Textos de las reglas agregadas, quitadas, modificadas o que cambiaron de
+    orden relativo entre dos librerías (dicts de cargar_libreria).
+
+    Una regla solo puede ganar en un documento que contiene todos sus textos:
+    un documento sin ninguno de estos textos se clasifica igual con ambas.
+    """
+    textos = set()
+    for grupo, campos in GRUPOS:
+        viejas, nuevas_g = _firmas(anteriores[grupo], campos), _firmas(nuevas[grupo], campos)
+        comunes = set(viejas) & set(nuevas_g)
+        # Entre las reglas que siguen, las que cambiaron de puesto relativo
+        puesto = {f: i for i, f in enumerate(f for f in viejas if f in comunes)}
+        movidas = {f for i, f in enumerate(f for f in nuevas_g if f in comunes) if puesto[f] != i}
+        for firma, _ in (set(viejas) ^ set(nuevas_g)) | movidas:
+            textos.update(t for t in json.loads(firma)[:len(campos)] if t)
+    return textos
+
+
+class MemoClasificacion:
+    """
+    LRU acotado de clasificaciones por (versión de las reglas, hash del texto
+    normalizado de la factura). La llave es el texto completo en orden, no el
+    conjunto de descripciones: un texto de regla puede cruzar de una línea a
+    la siguiente.
+    """
+
+    def __init__(self, maximo=MEMO_MAXIMO):
+        self.maximo = maximo
+        self.aciertos = 0
+        self.fallos = 0
+        self._memo = OrderedDict()
+
+    def clasificar(self, motor, texto):
+        if self.maximo <= 0:
+            return motor.clasificar(texto)
+        clave = (motor.version, hashlib.blake2b(texto.encode(), digest_size=16).digest())
+        resultado = self._memo.get(clave)
+        if resultado is not None:
+            self._memo.move_to_end(clave)
+            self.aciertos += 1
+            return resultado
+        self.fallos += 1
+        resultado = self._memo[clave] = motor.clasificar(texto)
+        if len(self._memo) > self.maximo:
+            self._memo.popitem(last=False)
+        return resultado
+
+    def resumen(self):
+        """Línea de resumen para el log de la corrida"""
+        consultas = self.aciertos + self.fallos
+        tasa = f" ({self.aciertos / consultas:.0%})" if consultas else ""
+        return (f"{self.aciertos} aciertos, {self.fallos} fallos{tasa}, "
+                f"{len(self._memo)}/{self.maximo} entradas")
+
+
+MEMO_CLASIFICACION = MemoClasificacion()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Paridad entre motores de extracción de PDF (pdfplumber vs pypdfium2).
+
+Corre ambos motores sobre un corpus de PDFs y compara lo que importa al
+pipeline: el encabezado de extract_header_regex y las líneas de
+extract_items_from_pdf. Informa diferencias por documento y el tiempo de
+cada motor, para decidir si se puede cambiar PDF_BACKEND sin riesgo.
+
+Corpus:
+  python scripts/paridad_pdf.py pdf_attachments/        # PDFs en un directorio
+  python scripts/paridad_pdf.py fixtures/               # mensajes grabados (gmail_simulado)
+  python scripts/paridad_pdf.py sintetico:500           # PDFs sintéticos
+
+Sale con código 1 si hay diferencias.
+"""
+
+import argparse
+import base64
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import Procesar
+from Procesar import BACKENDS_PDF, CACHE_PARSEO, parse_pdf
+
+
+def corpus_pdfs(fuente):
+    """(filename, bytes) de cada PDF del corpus"""
+    if os.path.isdir(fuente) and not os.path.exists(os.path.join(fuente, 'mensajes.jsonl')):
+        for nombre in sorted(os.listdir(fuente)):
+            if nombre.lower().endswith('.pdf'):
+                with open(os.path.join(fuente, nombre), 'rb') as f:
+                    yield nombre, f.read()
+        return
+
+    from gmail_simulado import cargar_fixtures, generar_sinteticos
+    if fuente.startswith('sintetico'):
+        _, _, n = fuente.partition(':')
+        registros = generar_sinteticos(int(n or 200))
+    else:
+        registros = cargar_fixtures(fuente)
+    for registro in registros:
+        payload = registro['message'].get('payload', {})
+        for part in payload.get('parts', []) or [payload]:
+            nombre = part.get('filename') or ''
+            att_id = part.get('body', {}).get('attachmentId')
+            if nombre.lower().endswith('.pdf') and att_id in registro['attachments']:
+                yield nombre, base64.urlsafe_b64decode(registro['attachments'][att_id])
+
+
+def diferencias(ref, otro):
+    """Lista de diferencias legibles entre dos DocumentoPDF"""
+    difs = []
+    for clave in sorted(set(ref.header) | set(otro.header)):
+        if ref.header.get(clave) != otro.header.get(clave):
+            difs.append(f"encabezado {clave}: {ref.header.get(clave)!r} != {otro.header.get(clave)!r}")
+    if len(ref.lineas) != len(otro.lineas):
+        difs.append(f"líneas: {len(ref.lineas)} != {len(otro.lineas)}")
+    for a, b in zip(ref.lineas, otro.lineas):
+        if a != b:
+            campos = [k for k in a if a.get(k) != b.get(k)]
+            difs.append(f"línea {a.get('linea_numero')}: " +
+                        ", ".join(f"{k} {a.get(k)!r} != {b.get(k)!r}" for k in campos))
+    return difs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara motores de extracción de PDF")
+    parser.add_argument('corpus', help="Directorio de PDFs, fixtures de gmail_simulado o sintetico:N")
+    parser.add_argument('--referencia', default='pdfplumber', choices=list(BACKENDS_PDF))
+    parser.add_argument('--candidato', default='pypdfium2', choices=list(BACKENDS_PDF))
+    parser.add_argument('--mostrar', type=int, default=20, help="Máximo de documentos con diferencias a listar")
+    args = parser.parse_args()
+
+    # Se mide y compara cada motor tal cual: sin cache de parseo (ni entradas
+    # nuevas en él), sin recorte por plantilla (solo aplica a pdfplumber) y sin
+    # el tope de RSS, que re-extraería con pypdfium2 del lado de pdfplumber
+    CACHE_PARSEO.activo = False
+    Procesar.PDF_RECORTE = False
+    Procesar.PDF_MAX_RSS_MB = 0
+    tiempos = {args.referencia: 0.0, args.candidato: 0.0}
+    total, con_diferencias, mostrados = 0, 0, 0
+    for nombre, data in corpus_pdfs(args.corpus):
+        docs = {}
+        for backend in (args.referencia, args.candidato):
+            t0 = time.perf_counter()
+            docs[backend] = parse_pdf(data, nombre, backend=backend)
+            tiempos[backend] += time.perf_counter() - t0
+        total += 1
+
+        difs = diferencias(docs[args.referencia], docs[args.candidato])
+        if difs:
+            con_diferencias += 1
+            if mostrados < args.mostrar:
+                mostrados += 1
+                print(f"❌ {nombre}")
+                for d in difs:
+                    print(f"   {d}")
+
+    print("\n" + "=" * 60)
+    print(f"📄 Documentos: {total}  |  con diferencias: {con_diferencias}")
+    for backend, segundos in tiempos.items():
+        print(f"⏱️ {backend}: {segundos:.2f}s ({segundos / total * 1000 if total else 0:.1f} ms/PDF)")
+    if total and tiempos[args.candidato]:
+        print(f"🚀 {args.candidato} es {tiempos[args.referencia] / tiempos[args.candidato]:.1f}x "
+              f"respecto de {args.referencia}")
+    return 1 if con_diferencias else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
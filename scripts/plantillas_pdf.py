@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Extracción por regiones de facturas y notas de crédito (page.crop de pdfplumber).
+
+Una plantilla por tipo de documento ('factura' / 'nota') define tres cajas en
+fracciones del tamaño de página:
+  encabezado → renglón con el número de documento
+  items      → tabla de líneas de items
+  totales    → bloque SUBTOTAL / descuento / NETO / IVA / TOTAL
+y los campos de encabezado que todas las muestras traían ('campos').
+
+La primera página se extrae por regiones; las siguientes (documentos largos)
+completas. Si el resultado no calza con la plantilla (falta el número o uno
+de sus campos, no hay líneas o la numeración de líneas tiene saltos), el
+llamador vuelve a la extracción de página completa.
+
+Las plantillas se aprenden de un corpus de PDFs:
+  python scripts/plantillas_pdf.py aprender pdf_attachments/
+  python scripts/plantillas_pdf.py aprender sintetico:200
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+
+import pdfplumber
+
+PLANTILLAS_FILE = os.getenv('PDF_PLANTILLAS', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           'plantillas_pdf.json'))
+REGIONES = ('encabezado', 'items', 'totales')
+# Holgura alrededor de cada región aprendida (fracción de la página)
+MARGEN = 0.01
+
+_plantillas = None
+
+
+# ============ PLANTILLAS ============
+
+def cargar_plantillas(ruta=PLANTILLAS_FILE):
+    """{tipo: {region: [x0, top, x1, bottom]}} desde JSON ({} si no hay archivo)"""
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def guardar_plantillas(plantillas, ruta=PLANTILLAS_FILE):
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(plantillas, f, indent=2)
+    print(f"✅ Plantillas guardadas en {ruta} ({', '.join(plantillas) or 'ninguna'})")
+
+
+def plantilla_documento(tipo):
+    """Plantilla de 'factura' o 'nota' (None si no hay); el archivo se lee una vez por proceso"""
+    global _plantillas
+    if _plantillas is None:
+        _plantillas = cargar_plantillas()
+    return _plantillas.get(tipo)
+
+
+# ============ EXTRACCIÓN ============
+
+def _caja_absoluta(page, caja):
+    """Caja relativa → coordenadas de la página, recortada a sus bordes"""
+    x0, top, x1, bottom = page.bbox
+    ancho, alto = x1 - x0, bottom - top
+    return (
+        x0 + max(0.0, caja[0]) * ancho,
+        top + max(0.0, caja[1]) * alto,
+        x0 + min(1.0, caja[2]) * ancho,
+        top + min(1.0, caja[3]) * alto,
+    )
+
+
+def paginas_recortadas(pdf, plantilla):
+    """
+    Texto por página de un PDF de pdfplumber ya abierto: la primera página
+    solo con las regiones de la plantilla (en orden vertical), el resto completas.
+    """
+    primera = pdf.pages[0]
+    cajas = sorted((_caja_absoluta(primera, plantilla[r]) for r in REGIONES if r in plantilla),
+                   key=lambda c: c[1])
+    partes = [primera.crop(caja).extract_text() or "" for caja in cajas]
+    primera.close()
+    paginas = ['\n'.join(p for p in partes if p)]
+    for page in pdf.pages[1:]:
+        paginas.append(page.extract_text() or "")
+        page.close()
+    return paginas
+
+
+def plantilla_coincide(doc, plantilla):
+    """True si lo extraído por regiones parece un documento completo"""
+    numeros = [l['linea_numero'] for l in doc.lineas]
+    return (bool(doc.header.get('numero'))
+            and all(doc.header.get(campo) is not None for campo in plantilla.get('campos', ['TOTAL']))
+            and bool(numeros)
+            and numeros == list(range(1, len(numeros) + 1)))
+
+
+# ============ APRENDIZAJE ============
+
+def _envolvente(cajas):
+    return [min(c[0] for c in cajas), min(c[1] for c in cajas),
+            max(c[2] for c in cajas), max(c[3] for c in cajas)]
+
+
+def regiones_pagina(page):
+    """
+    Cajas relativas de encabezado, items y totales en una página de un
+    documento de una página, más los campos de encabezado presentes, o None
+    si no se reconocen los tres bloques.
+    """
+    from Procesar import _HEADER_RES, _NUMERO_RE, extract_header_regex
+    from lineas_pdf import LINEA_RE
+
+    ancho, alto = page.width, page.height
+    encabezado, items, totales = [], [], []
+    for renglon in page.extract_text_lines():
+        caja = (renglon['x0'] / ancho, renglon['top'] / alto, renglon['x1'] / ancho, renglon['bottom'] / alto)
+        texto = renglon['text']
+        if LINEA_RE.match(texto):
+            items.append(caja)
+        elif not encabezado and not items and _NUMERO_RE.search(texto):
+            encabezado.append(caja)
+        elif items and any(p.search(texto) for patrones in _HEADER_RES.values() for p in patrones):
+            totales.append(caja)
+    if not (encabezado and items and totales):
+        return None
+    # La tabla de items ocupa todo el ancho: las descripciones varían de largo
+    caja_items = _envolvente(items)
+    caja_items[0], caja_items[2] = 0.0, 1.0
+    header = extract_header_regex(page.extract_text() or "")
+    return {'encabezado': _envolvente(encabezado), 'items': caja_items, 'totales': _envolvente(totales),
+            'campos': [campo for campo in _HEADER_RES if header.get(campo) is not None]}
+
+
+def aprender_plantillas(corpus):
+    """
+    Plantillas por tipo a partir de [(filename, bytes)]: envolvente, con
+    margen, de las regiones de todos los documentos de una página reconocidos.
+    """
+    por_tipo = {}
+    for filename, data in corpus:
+        with pdfplumber.open(io.BytesIO(data)) as pdf:
+            regiones = regiones_pagina(pdf.pages[0]) if len(pdf.pages) == 1 else None
+        if regiones:
+            tipo = 'nota' if 'nota' in filename.lower() else 'factura'
+            por_tipo.setdefault(tipo, []).append(regiones)
+
+    plantillas = {}
+    for tipo, muestras in por_tipo.items():
+        plantillas[tipo] = {}
+        for r in REGIONES:
+            x0, top, x1, bottom = _envolvente([m[r] for m in muestras])
+            plantillas[tipo][r] = [round(max(0.0, x0 - MARGEN), 4), round(max(0.0, top - MARGEN), 4),
+                                   round(min(1.0, x1 + MARGEN), 4), round(min(1.0, bottom + MARGEN), 4)]
+        # Campos que traían todas las muestras: si faltan, el recorte perdió algo
+        plantillas[tipo]['campos'] = [c for c in muestras[0]['campos'] if all(c in m['campos'] for m in muestras)]
+        print(f"📐 {tipo}: {len(muestras)} documentos de muestra, campos {plantillas[tipo]['campos']}")
+    return plantillas
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Plantillas de extracción por regiones")
+    sub = parser.add_subparsers(dest='comando', required=True)
+    p_aprender = sub.add_parser('aprender', help="Aprender plantillas de un corpus")
+    p_aprender.add_argument('corpus', help="Directorio de PDFs, fixtures de gmail_simulado o sintetico:N")
+    p_aprender.add_argument('--salida', default=PLANTILLAS_FILE)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from paridad_pdf import corpus_pdfs
+    guardar_plantillas(aprender_plantillas(corpus_pdfs(args.corpus)), args.salida)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Pool de procesos con tiempo máximo por tarea.
+
+ProcessPoolExecutor no puede interrumpir una tarea en curso: un PDF
+patológico que deja a pdfplumber dando vueltas retiene su proceso (y la
+corrida) indefinidamente. Aquí cada proceso del pool atiende una tarea a la
+vez por su propio Pipe; si la tarea pasa de `limite_s` segundos el proceso
+se mata, se reemplaza por uno nuevo y el futuro de esa tarea falla con
+TareaAbandonada. Lo mismo si el proceso muere (p. ej. un segfault en una
+librería nativa). Las demás tareas siguen.
+
+Los futuros se resuelven al pedir su resultado: FuturoAislado.result()
+atiende al pool hasta que su tarea termina.
+
+Los procesos (y sus reemplazos, que se crean en plena corrida mientras los
+hilos de descarga trabajan) salen de un forkserver y no de fork: hacer fork
+con hilos vivos puede dejar al hijo trabado en un lock. Por eso `funcion`
+debe ser una función de módulo (se importa en el proceso) y el script
+principal debe proteger su ejecución con `if __name__ == '__main__'`.
+"""
+
+import multiprocessing
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+
+class TareaAbandonada(Exception):
+    """La tarea superó el tiempo máximo o su proceso murió"""
+
+
+def _contexto_procesos(funcion):
+    """forkserver con el módulo de `funcion` precargado (spawn donde no hay forkserver)"""
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    contexto = multiprocessing.get_context('forkserver')
+    contexto.set_forkserver_preload(['__main__', funcion.__module__])
+    return contexto
+
+
+def _bucle_trabajador(conn, funcion):
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            return
+        if args is None:
+            return
+        try:
+            conn.send((True, funcion(*args)))
+        except Exception as e:
+            try:
+                conn.send((False, e))
+            except Exception:
+                # Excepción que no se puede serializar: se envía su descripción
+                conn.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+class FuturoAislado:
+    """Resultado pendiente de una tarea de PoolAislado"""
+
+    def __init__(self, pool, args):
+        self._pool = pool
+        self.args = args
+        self.listo = False
+        self._ok = None
+        self._valor = None
+
+    def _resolver(self, ok, valor):
+        self.listo, self._ok, self._valor = True, ok, valor
+        self.args = None
+
+    def result(self):
+        """Valor de la tarea; re-lanza su excepción, o TareaAbandonada"""
+        while not self.listo:
+            self._pool._atender()
+        if self._ok:
+            return self._valor
+        raise self._valor
+
+
+class _Trabajador:
+    def __init__(self, funcion, contexto):
+        self.conn, hijo = contexto.Pipe()
+        self.proceso = contexto.Process(target=_bucle_trabajador, args=(hijo, funcion), daemon=True)
+        self.proceso.start()
+        hijo.close()
+        self.futuro = None
+        self.inicio = None
+
+    def asignar(self, futuro):
+        self.futuro, self.inicio = futuro, time.monotonic()
+        self.conn.send(futuro.args)
+
+    def liberar(self):
+        futuro, self.futuro, self.inicio = self.futuro, None, None
+        return futuro
+
+    def matar(self):
+        self.proceso.kill()
+        self.proceso.join()
+        self.conn.close()
+
+    def cerrar(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.proceso.join(timeout=5)
+        if self.proceso.is_alive():
+            self.proceso.kill()
+            self.proceso.join()
+        self.conn.close()
+
+
+class PoolAislado:
+    """
+    `workers` procesos que ejecutan `funcion(*args)`. limite_s = 0 sin tiempo
+    máximo (solo protege de procesos que mueren).
+    """
+
+    def __init__(self, funcion, workers, limite_s=0):
+        self.funcion = funcion
+        self.limite_s = limite_s
+        self.abandonadas = 0
+        self._contexto = _contexto_procesos(funcion)
+        self._trabajadores = [_Trabajador(funcion, self._contexto) for _ in range(max(1, workers))]
+        self._cola = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def submit(self, *args):
+        futuro = FuturoAislado(self, args)
+        self._cola.append(futuro)
+        self._repartir()
+        return futuro
+
+    def _repartir(self):
+        for t in self._trabajadores:
+            if not self._cola:
+                return
+            if t.futuro is None:
+                t.asignar(self._cola.popleft())
+
+    def _atender(self):
+        """Espera a que termine alguna tarea en curso o venza su plazo, y la resuelve"""
+        ocupados = [t for t in self._trabajadores if t.futuro is not None]
+        espera = None
+        if self.limite_s:
+            espera = max(0.0, min(t.inicio for t in ocupados) + self.limite_s - time.monotonic())
+        listos = wait([t.conn for t in ocupados], espera)
+
+        for i, t in enumerate(self._trabajadores):
+            if t.futuro is None:
+                continue
+            if t.conn in listos:
+                try:
+                    ok, valor = t.conn.recv()
+                except (EOFError, OSError):
+                    t.proceso.join()
+                    self._reemplazar(i, f"el proceso terminó (código {t.proceso.exitcode})")
+                    continue
+                t.liberar()._resolver(ok, valor)
+            elif self.limite_s and time.monotonic() - t.inicio >= self.limite_s:
+                self._reemplazar(i, f"superó el tiempo máximo de {self.limite_s:g}s")
+        self._repartir()
+
+    def _reemplazar(self, i, motivo):
+        t = self._trabajadores[i]
+        futuro = t.liberar()
+        t.matar()
+        self._trabajadores[i] = _Trabajador(self.funcion, self._contexto)
+        self.abandonadas += 1
+        futuro._resolver(False, TareaAbandonada(motivo))
+
+    def cerrar(self):
+        """Termina los procesos; las tareas aún en curso se matan"""
+        for t in self._trabajadores:
+            if t.futuro is not None:
+                t.matar()
+            else:
+                t.cerrar()
+        self._trabajadores = []
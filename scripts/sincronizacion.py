@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Sincronización incremental del buzón Gmail.
+
+Modo 'history': usa users().history().list desde el último historyId guardado,
+de modo que una ejecución diaria solo toca los cambios del buzón desde el último
+checkpoint. Si no hay historyId o expiró (HTTP 404), cae al query por fecha
+(`after:`) de siempre.
+
+Solo depende del objeto `service`, así que funciona igual con el cliente real
+de googleapiclient que con un servicio Gmail simulado.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from cliente_gmail import http_hilo
+from control_cuota import CONTROLADOR, http_status
+
+HISTORY_ID_FILE = 'last_history_id.txt'
+# Hilos para listar en paralelo los tramos mensuales de un backfill. 0 o 1 = un solo query
+GMAIL_LIST_WORKERS = int(os.getenv('GMAIL_LIST_WORKERS', '4'))
+
+
+# ============ ESTADO ============
+
+def read_history_id(path=HISTORY_ID_FILE):
+    """Lee el último historyId guardado (None si no existe)"""
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return f.read().strip() or None
+    return None
+
+
+def save_history_id(history_id, path=HISTORY_ID_FILE):
+    """Guarda el historyId del checkpoint"""
+    with open(path, 'w') as f:
+        f.write(str(history_id))
+    print(f"🔖 historyId guardado: {history_id}")
+
+
+# ============ LISTADO ============
+
+def get_all_messages(service, query, processed=None):
+    """
+    Obtiene todos los mensajes que coinciden con el query.
+    Con `processed`, deja de paginar tras una página completa de IDs ya
+    procesados: Gmail lista del más nuevo al más antiguo, lo que sigue es historia.
+    """
+    messages = []
+    page_token = None
+    while True:
+        request = service.users().messages().list(userId='me', q=query, pageToken=page_token)
+        http = http_hilo(service)
+        resp = CONTROLADOR.ejecutar('messages.list', lambda: request.execute(http=http))
+        msgs = resp.get('messages', [])
+        if not msgs:
+            break
+        messages.extend(msgs)
+        if processed and all(m['id'] in processed for m in msgs):
+            break
+        page_token = resp.get('nextPageToken')
+        if not page_token:
+            break
+    return messages
+
+
+def month_shards(desde, hasta):
+    """
+    Divide [desde, hasta] en tramos por mes calendario: [(after, before), ...].
+    El último tramo queda abierto (before=None), igual que el query sin tramos.
+    """
+    inicios = [desde]
+    while True:
+        ultimo = inicios[-1]
+        siguiente = date(ultimo.year + ultimo.month // 12, ultimo.month % 12 + 1, 1)
+        if siguiente > hasta:
+            break
+        inicios.append(siguiente)
+    return list(zip(inicios, inicios[1:] + [None]))
+
+
+def list_messages_sharded(service, base_query, desde, processed=None, workers=GMAIL_LIST_WORKERS):
+    """
+    Lista `base_query after:desde` repartiendo el rango en tramos mensuales
+    que se listan en paralelo. Une los resultados del más nuevo al más
+    antiguo y sin duplicados. Un rango de un solo mes es un único query.
+    """
+    desde = datetime.strptime(desde, '%Y-%m-%d').date()
+    shards = month_shards(desde, date.today())
+    queries = []
+    for after, before in shards:
+        query = f'{base_query} after:{after:%Y/%m/%d}'
+        if before:
+            query += f' before:{before:%Y/%m/%d}'
+        queries.append(query)
+
+    if len(queries) <= 1 or workers <= 1:
+        return get_all_messages(service, f'{base_query} after:{desde:%Y/%m/%d}', processed)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='listado') as pool:
+        resultados = list(pool.map(lambda q: get_all_messages(service, q, processed), reversed(queries)))
+
+    messages, vistos = [], set()
+    for resultado in resultados:
+        for m in resultado:
+            if m['id'] not in vistos:
+                vistos.add(m['id'])
+                messages.append(m)
+    print(f"🧩 Listado en {len(queries)} tramos mensuales ({workers} hilos)")
+    return messages
+
+
+def current_history_id(service):
+    """historyId actual del buzón (punto de partida del próximo checkpoint)"""
+    request = service.users().getProfile(userId='me')
+    return CONTROLADOR.ejecutar('getProfile', request.execute).get('historyId')
+
+
+def list_history_added(service, start_history_id, label_id='INBOX'):
+    """
+    Lista los mensajes que entraron a `label_id` desde `start_history_id`
+    (mensajes nuevos o etiquetados después). Retorna (mensajes, nuevo_history_id).
+    """
+    messages, vistos = [], set()
+    nuevo_history_id = start_history_id
+    page_token = None
+    while True:
+        request = service.users().history().list(
+            userId='me',
+            startHistoryId=start_history_id,
+            historyTypes=['messageAdded', 'labelAdded'],
+            labelId=label_id,
+            pageToken=page_token,
+        )
+        resp = CONTROLADOR.ejecutar('history.list', request.execute)
+
+        for registro in resp.get('history', []):
+            cambios = registro.get('messagesAdded', []) + [
+                c for c in registro.get('labelsAdded', []) if label_id in c.get('labelIds', [])
+            ]
+            for cambio in cambios:
+                msg = cambio.get('message', {})
+                if msg.get('id') and msg['id'] not in vistos:
+                    vistos.add(msg['id'])
+                    messages.append({'id': msg['id'], 'threadId': msg.get('threadId')})
+
+        nuevo_history_id = resp.get('historyId', nuevo_history_id)
+        page_token = resp.get('nextPageToken')
+        if not page_token:
+            break
+    return messages, nuevo_history_id
+
+
+def sync_messages(service, base_query, desde, history_id, processed=None, label_id='INBOX', checkpoint=True):
+    """
+    Obtiene los mensajes candidatos de esta ejecución.
+    Retorna (mensajes, nuevo_history_id, modo) con modo 'history' o 'query'
+    (`base_query after:desde`, listado por tramos mensuales si es un backfill).
+    Con checkpoint=False (sin modo history) no se pide el historyId actual y
+    nuevo_history_id es None.
+
+    En modo 'history' los candidatos no están filtrados por remitente: el
+    llamador debe validar el encabezado From del sobre.
+    """
+    if history_id:
+        try:
+            messages, nuevo_history_id = list_history_added(service, history_id, label_id)
+            return messages, nuevo_history_id, 'history'
+        except Exception as e:
+            if http_status(e) != 404:
+                raise
+            print(f"⚠️ historyId {history_id} expirado, se usa el query por fecha")
+
+    # Tomar el checkpoint ANTES de listar: lo que llegue mientras tanto entra en la próxima corrida
+    nuevo_history_id = current_history_id(service) if checkpoint else None
+    return list_messages_sharded(service, base_query, desde, processed), nuevo_history_id, 'query'